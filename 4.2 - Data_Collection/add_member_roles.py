@@ -7,6 +7,7 @@ import json
 from sqlite3 import Error as SQLError
 from make_db import create_connection, create_table
 from lxml import etree
+from http_cache import fetch
 
 sys.path.insert(1, "../")
 from settings import DB_FP as db_fp
@@ -60,13 +61,13 @@ def get_posts_from_xml(curr_member, members_xml):
 
 
 def get_member_posts(member):
-    all_members_root = "http://data.parliament.uk/membersdataplatform/services/mnis/members/query/House=Commons|Membership=all/GovernmentPosts|OppositionPosts|ParliamentaryPosts/"
+    all_members_url = "http://data.parliament.uk/membersdataplatform/services/mnis/members/query/House=Commons|Membership=all/GovernmentPosts|OppositionPosts|ParliamentaryPosts/"
 
     if member['MnisId'] is not None:
-        curr_member_tree = etree.parse("http://data.parliament.uk/membersdataplatform/services/mnis/members/query/House=Commons|id={}|Membership=all/GovernmentPosts|OppositionPosts|ParliamentaryPosts".format(member['MnisId']))
-        curr_member_root = curr_member_tree.getroot()
+        curr_member_root = etree.fromstring(fetch("http://data.parliament.uk/membersdataplatform/services/mnis/members/query/House=Commons|id={}|Membership=all/GovernmentPosts|OppositionPosts|ParliamentaryPosts".format(member['MnisId'])))
         return get_posts_from_xml(member, curr_member_root)
     else:
+        all_members_root = etree.fromstring(fetch(all_members_url))
         return get_posts_from_xml(member, all_members_root)
 
 
@@ -259,5 +259,9 @@ if __name__ == "__main__":
 
     create_stance_table(mp_stances, conn)
 
+    # Update the statistics SQLite uses to plan queries, now there's a new table joined on in the analysis.
+    # member_stances doesn't need an index of its own, as PimsId is its (integer) primary key.
+    conn.commit()
+    conn.execute("ANALYZE;")
     conn.commit()
     conn.close()
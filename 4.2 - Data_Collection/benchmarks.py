@@ -0,0 +1,377 @@
+# Benchmarks for the slower parts of the pipeline.
+# Run with the name of a benchmark, e.g.
+#   python benchmarks.py process_xml [xml directory]
+# If no directory is given, synthetic sittings are made up to run it on.
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+from io import BytesIO
+
+
+NAMESPACE = "http://www.parliament.uk/benchmark"
+
+
+# Makes up a sitting in the same shape as the Hansard xml.
+# Each question is answered by a speech with n_continuations extra paragraphs.
+def make_synthetic_sitting(n_sections=10, n_questions=20, n_continuations=5, words_per_para=60, chan=1):
+    words = " ".join(["word"] * words_per_para)
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n',
+             '<Hansard xmlns="{}"><System type="Debate"><Fragment>'.format(NAMESPACE),
+             '<Header><Sitting short-date="23 June 2016"/></Header><Body>\n']
+
+    uid = chan * 10000000
+    for section in range(n_sections):
+        parts.append('<hs_2DebBill>Section {}</hs_2DebBill>\n'.format(section))
+        parts.append('<hs_3OralAnswers>Oral Answers to Questions</hs_3OralAnswers>\n')
+        parts.append('<hs_6bDepartment><DepartmentName>Department {}</DepartmentName></hs_6bDepartment>\n'.format(section))
+        for question in range(n_questions):
+            parts.append('<hs_8Question>Topic {}</hs_8Question>\n'.format(question))
+            uid += 1
+            parts.append('<Question><hs_Para UID="{0}"><Member PimsId="{1}" MnisId="{1}" xid="{1}" ContinuationText="Member {1}" '
+                         'ContributionType="Oral">Member</Member> {2}</hs_Para><QuestionText>{2}?</QuestionText></Question>\n'
+                         .format(uid, question % 50 + 1, words))
+            uid += 1
+            parts.append('<hs_Para UID="{0}"><Member PimsId="1000" MnisId="1000" xid="1000" ContinuationText="The Minister">'
+                         'The Minister</Member> {1} <I>emphasis</I> {1}</hs_Para>\n'.format(uid, words))
+            for continuation in range(n_continuations):
+                uid += 1
+                parts.append('<hs_Para UID="{0}">{1}</hs_Para>\n'.format(uid, words))
+            parts.append('<hs_brev>"A quote from somewhere"</hs_brev>\n')
+
+    parts.append('</Body></Fragment></System></Hansard>\n')
+    return "".join(parts).encode("utf-8")
+
+
+# Gets the bytes of the sittings to run on, either from a directory or made up.
+def get_sittings(xml_dir=None, n_sittings=20, **kwargs):
+    if not xml_dir:
+        return [("{}-CHAN{}.xml".format(i, i), make_synthetic_sitting(chan=i, **kwargs)) for i in range(n_sittings)]
+
+    sittings = []
+    for subdir, dirs, files in os.walk(xml_dir):
+        for filename in files:
+            if filename.endswith("xml"):
+                with open(os.path.join(subdir, filename), "rb") as xml_file:
+                    sittings.append((filename, xml_file.read()))
+    return sittings
+
+
+# Runs the function on each sitting, returning the results, the time taken and the peak memory of a single sitting.
+def time_parser(parse, sittings):
+    results = []
+    peak = 0
+    seconds = 0.0
+    for filename, data in sittings:
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        results.append(parse(BytesIO(data), filename, set()))
+        seconds += time.perf_counter() - start_time
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return results, seconds, peak
+
+
+# Compares loading the whole tree with streaming it through iterparse.
+def benchmark_process_xml(xml_dir=None):
+    from process_xml import process_debate_tree, process_debate_stream
+
+    sittings = get_sittings(xml_dir)
+    total_mb = sum(len(data) for filename, data in sittings) / (1024 * 1024)
+    print("{0} sittings, {1:.1f} MB".format(len(sittings), total_mb))
+
+    tree_results, tree_seconds, tree_peak = time_parser(process_debate_tree, sittings)
+    stream_results, stream_seconds, stream_peak = time_parser(process_debate_stream, sittings)
+
+    print("{0:<10} {1:>10} {2:>10} {3:>16}".format("Parser", "Seconds", "MB/s", "Peak memory (MB)"))
+    for name, seconds, peak in [("tree", tree_seconds, tree_peak), ("stream", stream_seconds, stream_peak)]:
+        print("{0:<10} {1:>10.2f} {2:>10.2f} {3:>16.1f}".format(name, seconds, total_mb / seconds, peak / (1024 * 1024)))
+
+    print("Same output: {}".format(tree_results == stream_results))
+
+
+# Times processing the same sittings with more and more workers.
+def benchmark_process_xml_workers(xml_dir=None, max_workers=None):
+    from process_xml import get_all_fps, process_all
+
+    max_workers = os.cpu_count() if max_workers is None else int(max_workers)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # Made up sittings need writing out first so the workers have files to read.
+        if not xml_dir:
+            xml_dir = os.path.join(tmp_dir, "xml")
+            os.makedirs(xml_dir)
+            for filename, data in get_sittings(n_sittings=max_workers * 8):
+                with open(os.path.join(xml_dir, filename), "wb") as xml_file:
+                    xml_file.write(data)
+
+        all_fps = get_all_fps(xml_dir)
+        total_mb = sum(os.path.getsize(fp) for fp in all_fps) / (1024 * 1024)
+        print("{0} files, {1:.1f} MB".format(len(all_fps), total_mb))
+
+        print("{0:<10} {1:>10} {2:>10} {3:>10}".format("Workers", "Seconds", "MB/s", "Speed up"))
+        # Doubling the workers each time, finishing on the most we're allowed.
+        worker_counts = sorted(set([2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers] + [max_workers]))
+        base_seconds = None
+        for n_workers in worker_counts:
+            out_dir = os.path.join(tmp_dir, "out{}".format(n_workers))
+            os.makedirs(out_dir)
+            start_time = time.perf_counter()
+            process_all(all_fps, out_dir, n_workers)
+            seconds = time.perf_counter() - start_time
+            base_seconds = seconds if base_seconds is None else base_seconds
+            print("{0:<10} {1:>10.2f} {2:>10.2f} {3:>10.2f}".format(n_workers, seconds, total_mb / seconds,
+                                                                    base_seconds / seconds))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+# Times processing a single speech with more and more continuation paragraphs.
+# The time per paragraph should stay about the same; building the text up with format (the old way) is shown for comparison.
+def benchmark_long_speeches(max_paras=20000):
+    from process_xml import process_debate
+
+    print("{0:<12} {1:>10} {2:>14} {3:>14}".format("Paragraphs", "Seconds", "us/paragraph", "Format seconds"))
+    n_paras = 100
+    while n_paras <= int(max_paras):
+        data = make_synthetic_sitting(n_sections=1, n_questions=1, n_continuations=n_paras)
+        start_time = time.perf_counter()
+        process_debate(BytesIO(data), "1-CHAN1.xml", set())
+        seconds = time.perf_counter() - start_time
+
+        para_text = " ".join(["word"] * 60)
+        start_time = time.perf_counter()
+        text = ""
+        for i in range(n_paras):
+            text = "{0} {1}".format(text, para_text)
+        format_seconds = time.perf_counter() - start_time
+
+        print("{0:<12} {1:>10.3f} {2:>14.1f} {3:>14.3f}".format(n_paras, seconds, seconds / n_paras * 1000000, format_seconds))
+        n_paras *= 4
+
+
+# Gets the memory needed to load some json, with the member dicts interned as make_db does.
+def get_load_memory(data):
+    from debate_io import intern_member
+
+    tracemalloc.start()
+    members = dict()
+    debate = {uid: intern_member(members, contribution) for uid, contribution in json.loads(data).items()}
+    peak = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return peak
+
+
+# Compares the size of the json when answers refer to their question by UID, against having the whole question in them.
+# The embedded size is worked out by putting the questions back in, so questions that weren't kept are missed out.
+def benchmark_json_size(xml_dir=None):
+    from process_xml import process_debate
+
+    sizes = {"embedded": 0, "uid": 0}
+    memory = {"embedded": 0, "uid": 0}
+    for filename, data in get_sittings(xml_dir):
+        debate = process_debate(BytesIO(data), filename, set())
+        embedded = {uid: dict(para, question=debate.get(para['question'], para['question'])) if para.get('question') else para
+                    for uid, para in debate.items()}
+
+        for name, curr_debate in [("embedded", embedded), ("uid", debate)]:
+            curr_json = json.dumps(curr_debate)
+            sizes[name] += len(curr_json.encode("utf-8"))
+            memory[name] = max(memory[name], get_load_memory(curr_json))
+
+    print("{0:<10} {1:>12} {2:>22}".format("Questions", "JSON (MB)", "Largest load (MB)"))
+    for name in ["embedded", "uid"]:
+        print("{0:<10} {1:>12.2f} {2:>22.2f}".format(name, sizes[name] / (1024 * 1024), memory[name] / (1024 * 1024)))
+    print("JSON is {:.1f}% smaller".format(100 * (1 - sizes['uid'] / sizes['embedded'])))
+
+
+# Makes up contributions in the same shape as the processed json, spread over sittings of per_sitting each.
+def make_synthetic_contributions(n_contributions, per_sitting=500):
+    words = " ".join(["word"] * 60)
+    for i in range(n_contributions):
+        yield {"uid": str(i + 1), "hansard_file": "{}-CHAN{}".format(i // per_sitting, i // per_sitting), "text": words,
+               "type": "Speech", "question": None, "topic": None, "section": "Section", "contribution_type": "Oral",
+               "section_tag": "hs_2DebBill", "member": {"member_id": str(i % 650 + 1), "member_mnis": None, "member_xid": None}}
+
+
+# The statement make_db.py used to add each contribution with.
+sql_insert_contribution_row = '''INSERT INTO contributions(uid, member, debate, body, isQuestion, referringTo, topic, section, contType, sectionTag, department)
+                            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);'''
+
+
+# Adds the rows the way make_db.py did before it loaded them in batches: an INSERT for each row, printing its row id
+# (to out_file, so printing to a terminal isn't what's timed), and a single commit once they're all in.
+def insert_rows_one_at_a_time(connection, command, rows, out_file):
+    cursor = connection.cursor()
+    for row in rows:
+        cursor.execute(command, row)
+        print(cursor.lastrowid, file=out_file)
+    connection.commit()
+
+
+# Adds the debates for the made up contributions, a week apart from 2010.
+# The sittings are spread evenly over the dates the analysis query asks for (see sql_get_all_posts),
+# so however many there are they all get picked up by it.
+def add_synthetic_debates(connection, n_contributions, per_sitting=500):
+    from datetime import datetime
+    from make_db import insert_rows, sql_insert_debate
+
+    first, last = datetime(2015, 5, 1), datetime(2019, 12, 11)
+    n_sittings = (n_contributions + per_sitting - 1) // per_sitting
+    insert_rows(connection, sql_insert_debate, (("{}-CHAN{}".format(i, i), first + (last - first) * i / n_sittings, i,
+                                                 "{}-CHAN{}".format(i, i)) for i in range(n_sittings)))
+
+
+# Compares adding contributions to a new database a row at a time, as make_db.py used to, with insert_rows.
+# Both are given the same rows, from get_contribution_rows. Building the indexes is timed on its own,
+# as make_db.py didn't make any when it added a row at a time.
+def benchmark_make_db(n_contributions=200000):
+    import sqlite3
+    from contextlib import redirect_stdout
+    from make_db import create_tables, set_load_pragmas, set_normal_pragmas, create_indexes, insert_rows
+    from make_db import get_contribution_rows, get_debate_ids, sql_insert_contribution
+
+    n_contributions = int(n_contributions)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print("{0:<14} {1:>10} {2:>12} {3:>14}".format("Loader", "Seconds", "Rows/s", "Index seconds"))
+        for name in ["row at a time", "insert_rows"]:
+            connection = sqlite3.connect(os.path.join(tmp_dir, "{}.db".format(name.replace(" ", "_"))))
+            index_seconds = None
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                create_tables(connection)
+                add_synthetic_debates(connection, n_contributions)
+                rows = get_contribution_rows([make_synthetic_contributions(n_contributions)], get_debate_ids(connection))
+                start_time = time.perf_counter()
+                if name == "insert_rows":
+                    set_load_pragmas(connection)
+                    insert_rows(connection, sql_insert_contribution, rows, "contributions")
+                    seconds = time.perf_counter() - start_time
+
+                    start_time = time.perf_counter()
+                    create_indexes(connection)
+                    set_normal_pragmas(connection)
+                    index_seconds = time.perf_counter() - start_time
+                else:
+                    insert_rows_one_at_a_time(connection, sql_insert_contribution_row, rows, devnull)
+                    seconds = time.perf_counter() - start_time
+            n_rows = connection.execute("SELECT COUNT(*) FROM contributions;").fetchone()[0]
+            connection.close()
+            print("{0:<14} {1:>10.2f} {2:>12.0f} {3:>14}".format(name, seconds, n_rows / seconds,
+                                                                 "-" if index_seconds is None else "{:.2f}".format(index_seconds)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+# The query every ACE script starts with (sql_get_all_posts), without c.usas_file which is added to the database later.
+sql_get_all_posts = """
+SELECT c.uid, m.name, m.PimsId, p.party, d.date, c.body, c.topic, c.section, s.tmay_deal, s.benn_act, s.ref_stance, s.constituency_leave
+FROM contributions as c
+INNER JOIN members as m
+ON m.PimsId = c.member
+INNER JOIN debates as d
+ON d.id = c.debate
+INNER JOIN member_party as p
+ON p.PimsId = m.PimsId
+INNER JOIN member_stances as s
+ON s.PimsId = m.PimsId
+WHERE (d.date BETWEEN date("2015-05-01") AND date("2019-12-11"))
+AND (((d.date BETWEEN p.start AND p.end) AND NOT (p.end IS NULL))
+OR ((d.date >= p.start) AND (p.end IS NULL)));""".strip()
+
+# As in add_stances.py.
+sql_create_member_stances = """
+CREATE TABLE IF NOT EXISTS member_stances (
+    PimsId integer NOT NULL,
+    tmay_deal text,
+    benn_act text,
+    ref_stance text,
+    constituency_leave integer,
+    PRIMARY KEY (PimsId),
+    FOREIGN KEY (PimsId) REFERENCES members (PimsId)
+);"""
+
+
+# Makes a database like make_db.py and add_stances.py would, without any of the indexes, for the made up contributions.
+# Each member changes party once, in 2017.
+def make_synthetic_db(db_fp, n_contributions, per_sitting=500, n_members=650):
+    import sqlite3
+    from make_db import create_tables, set_load_pragmas, add_contributions, insert_rows
+
+    connection = sqlite3.connect(db_fp)
+    create_tables(connection)
+    set_load_pragmas(connection)
+    connection.execute(sql_create_member_stances)
+
+    add_synthetic_debates(connection, n_contributions, per_sitting)
+    members = range(1, n_members + 1)
+    insert_rows(connection, "INSERT INTO members(PimsId, name) VALUES(?, ?);", ((m, "Member {}".format(m)) for m in members))
+    insert_rows(connection, "INSERT INTO member_party(PimsId, start, end, party) VALUES(?, ?, ?, ?);",
+                [(m, "2005-05-05T00:00:00", "2017-06-08T00:00:00", "Party A") for m in members] +
+                [(m, "2017-06-08T00:00:00", None, "Party B") for m in members])
+    insert_rows(connection, "INSERT INTO member_stances(PimsId, tmay_deal, benn_act, ref_stance, constituency_leave) VALUES(?, ?, ?, ?, ?);",
+                ((m, "aye", "no", "leave", 50) for m in members))
+    add_contributions([make_synthetic_contributions(n_contributions, per_sitting)], None, connection)
+    return connection
+
+
+# Times the analysis query and shows how SQLite runs it (EXPLAIN QUERY PLAN), before and after the indexes and ANALYZE.
+# Given a database it's run on that as it is instead (make a copy first, it isn't changed).
+# The output is also written to out_fp if given.
+def benchmark_query_plan(db_fp=None, out_fp=None, n_contributions=200000):
+    import sqlite3
+    import pathlib
+    from contextlib import redirect_stdout
+    from make_db import create_indexes, analyze_db, set_normal_pragmas
+
+    lines = []
+    def run(name, connection):
+        plan = connection.execute("EXPLAIN QUERY PLAN {}".format(sql_get_all_posts)).fetchall()
+        start_time = time.perf_counter()
+        n_rows = len(connection.execute(sql_get_all_posts).fetchall())
+        seconds = time.perf_counter() - start_time
+        # Timing a query that finds nothing wouldn't say anything about the real one.
+        assert db_fp or n_rows > 0, "The query found no rows in the synthetic database"
+        lines.append("{0}: {1} rows in {2:.2f} seconds".format(name, n_rows, seconds))
+        lines.extend("    {}".format(row[-1]) for row in plan)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if db_fp:
+            run(os.path.basename(db_fp), sqlite3.connect("{}?mode=ro".format(pathlib.Path(db_fp).resolve().as_uri()), uri=True))
+        else:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                connection = make_synthetic_db(os.path.join(tmp_dir, "commons.db"), int(n_contributions))
+            run("no indexes", connection)
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                create_indexes(connection)
+                analyze_db(connection)
+                set_normal_pragmas(connection)
+            run("indexes and ANALYZE", connection)
+            connection.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print("\n".join(lines))
+    if out_fp:
+        with open(out_fp, "w") as out_file:
+            out_file.write("\n".join(lines) + "\n")
+
+
+BENCHMARKS = {"json_size": benchmark_json_size,
+              "long_speeches": benchmark_long_speeches,
+              "make_db": benchmark_make_db,
+              "process_xml": benchmark_process_xml,
+              "query_plan": benchmark_query_plan,
+              "process_xml_workers": benchmark_process_xml_workers}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Pick a benchmark: {}".format(", ".join(BENCHMARKS)))
+        sys.exit(1)
+
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,148 @@
+# A content-addressed index of the xml we've already seen, so byte-identical copies are only handled once.
+# Each hash gets a marker file holding the name (and rank) of the copy that is kept: the one with the highest rank,
+# which is the id of the file it came from, so the newest copy is kept just as remove_duplicates.py would.
+# The other files with the same bytes are written to aliases.tsv instead.
+# Markers are only changed while holding a lock on the hash, so several processes can share an index.
+# Which copy is kept doesn't depend on the order the claims come in, but a process can't know it has lost until
+# everyone has finished, so settle_claims should be run on all the claims at the end.
+import os
+import time
+import hashlib
+import tempfile
+
+
+INDEX_DIR_NAME = ".content_index"
+# Streams bigger than this are spooled to disk while they are hashed.
+SPOOL_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+# A lock older than this (in seconds) was left behind by a process that died, so can be taken.
+STALE_LOCK = 60
+
+
+def get_index_dir(out_dir):
+    return os.path.join(out_dir, INDEX_DIR_NAME)
+
+
+# Copies a stream into a spooled temporary file, hashing it on the way.
+# Returns the hex digest and the temporary file (rewound to the start).
+def spool_and_hash(stream, spool_size=SPOOL_SIZE):
+    digest = hashlib.sha256()
+    spooled = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return digest.hexdigest(), spooled
+
+
+def get_marker_fp(index_dir, digest):
+    return os.path.join(index_dir, digest[:2], digest)
+
+
+# Holds a lock on a hash while a marker is looked at and changed.
+# Making a directory either works or fails in one go on every platform, so it's used as the lock.
+class MarkerLock:
+    def __init__(self, marker_fp):
+        self.lock_fp = "{}.lock".format(marker_fp)
+
+    def __enter__(self):
+        while True:
+            try:
+                os.mkdir(self.lock_fp)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lock_fp) > STALE_LOCK:
+                        os.rmdir(self.lock_fp)
+                except OSError:
+                    pass
+                time.sleep(0.001)
+
+    def __exit__(self, *args):
+        os.rmdir(self.lock_fp)
+
+
+# Reads a marker, returning the name and rank of the kept copy (or None, None if there's no marker).
+# Markers written before they had ranks are given a rank of -1.
+def read_marker(marker_fp):
+    if not os.path.isfile(marker_fp):
+        return None, None
+    with open(marker_fp) as marker_file:
+        parts = marker_file.read().split("\t")
+    return parts[0], int(parts[1]) if len(parts) > 1 else -1
+
+
+# Writes somewhere else and then moves it into place, so nobody reads half a marker.
+def write_marker(marker_fp, name, rank):
+    fd, tmp_fp = tempfile.mkstemp(dir=os.path.dirname(marker_fp))
+    with os.fdopen(fd, "w") as tmp_file:
+        tmp_file.write("{0}\t{1}".format(name, rank))
+    os.replace(tmp_fp, marker_fp)
+
+
+# Claims the hash for the given name, if its rank is higher than the copy kept so far (ties go to the higher name).
+# Returns the name of the copy that is now kept, which is this name if it won,
+# and the name of the copy it took over from (None if it didn't take over from anyone).
+def claim(index_dir, digest, name, rank=-1):
+    marker_fp = get_marker_fp(index_dir, digest)
+    os.makedirs(os.path.dirname(marker_fp), exist_ok=True)
+
+    with MarkerLock(marker_fp):
+        kept_name, kept_rank = read_marker(marker_fp)
+        if kept_name == name:
+            return name, None
+        if kept_name is not None and (kept_rank, kept_name) > (rank, name):
+            return kept_name, None
+        write_marker(marker_fp, name, rank)
+        return name, kept_name
+
+
+# Gets the name of the copy kept for a hash (None if we haven't seen it).
+def get_claim(index_dir, digest):
+    return read_marker(get_marker_fp(index_dir, digest))[0]
+
+
+# Once every claim has been made, works out which copies were kept and writes down the rest as aliases.
+# claims are (name, digest, replaced) as from claim, in the order they should be written to aliases.tsv.
+# Copies that aren't kept (whether from this run or an earlier one) are passed to remove, in case they were written.
+# Returns the names that were kept.
+def settle_claims(index_dir, claims, remove):
+    kept = set()
+    claimed = set(name for name, digest, replaced in claims)
+    for name, digest, replaced in claims:
+        first_name = get_claim(index_dir, digest)
+        if first_name == name:
+            kept.add(name)
+        else:
+            record_alias(index_dir, digest, name, first_name)
+            remove(name)
+        # A copy kept by an earlier run that this run has taken over from.
+        if replaced is not None and replaced not in claimed and replaced != first_name:
+            record_alias(index_dir, digest, replaced, first_name)
+            remove(replaced)
+    return kept
+
+
+# Writes down that a file is just a copy of one we've already got.
+def record_alias(index_dir, digest, name, first_name):
+    with open(os.path.join(index_dir, "aliases.tsv"), "a") as alias_file:
+        alias_file.write("{0}\t{1}\t{2}\n".format(digest, name, first_name))
+
+
+# Gets all the aliases in the index as a dictionary from alias name to the name of the copy that was kept.
+# A copy that was kept and then taken over by a newer one is followed through to the newer one.
+def get_aliases(index_dir):
+    aliases = dict()
+    alias_fp = os.path.join(index_dir, "aliases.tsv")
+    if os.path.isfile(alias_fp):
+        with open(alias_fp) as alias_file:
+            for line in alias_file:
+                digest, name, first_name = line.rstrip("\n").split("\t")
+                aliases[name] = first_name
+
+    for name in aliases:
+        seen = {name}
+        while aliases[name] in aliases and aliases[name] not in seen:
+            seen.add(aliases[name])
+            aliases[name] = aliases[aliases[name]]
+    return aliases
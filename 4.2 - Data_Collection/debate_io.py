@@ -0,0 +1,107 @@
+# Reading and writing the processed debates.
+# A debate can be written as a single json object from UID to contribution (.json),
+# or as one contribution per line (.ndjson) so it can be read a contribution at a time.
+# The final debates are kept in year=YYYY/month=MM directories, so a date range only has to look in the months it covers.
+import os
+import re
+import json
+
+
+FORMATS = {"json": ".json", "ndjson": ".ndjson"}
+
+
+# Gets the bytes to write for a debate in the given format.
+def dump_debate(hansard_debate, out_format="json"):
+    if out_format == "ndjson":
+        return "".join("{}\n".format(json.dumps(contribution)) for contribution in hansard_debate.values()).encode("utf-8")
+    return json.dumps(hansard_debate).encode("utf-8")
+
+
+def is_debate_file(fp):
+    return any(fp.endswith(ext) for ext in FORMATS.values())
+
+
+# Gets the debate file's name without its extension.
+def strip_extension(fp):
+    for ext in FORMATS.values():
+        if fp.endswith(ext):
+            return fp[:-len(ext)]
+    return fp
+
+
+# Gets the directory a debate from the given date (YYYY-MM-DD) goes in.
+def get_partition_dir(dir_fp, date):
+    return os.path.join(dir_fp, "year={}".format(date[:4]), "month={}".format(date[5:7]))
+
+
+# Checks whether a directory could have anything between the start and end dates (YYYY-MM-DD) in it.
+# Directories that aren't partitions always could.
+def partition_in_range(parent_dir, dirname, start=None, end=None):
+    m = re.fullmatch(r"year=(\d\d\d\d)", dirname)
+    if m is not None:
+        period = m.group(1)
+    else:
+        m = re.fullmatch(r"month=(\d\d)", dirname)
+        y = re.fullmatch(r"year=(\d\d\d\d)", os.path.basename(parent_dir))
+        if m is None or y is None:
+            return True
+        period = "{0}-{1}".format(y.group(1), m.group(1))
+
+    # Compare with the same amount of the dates, e.g. 2019 with 2019 or 2019-06 with 2019-06.
+    return (start is None or period >= start[:len(period)]) and (end is None or period <= end[:len(period)])
+
+
+# Checks whether a debate's date (from the start of its file name) is between the start and end dates.
+# Files without a date in their name always are.
+def file_in_range(filename, start=None, end=None):
+    m = re.match(r"(\d\d\d\d\-\d\d\-\d\d)\-", filename)
+    if m is None:
+        return True
+    return (start is None or m.group(1) >= start) and (end is None or m.group(1) <= end)
+
+
+# Gets every debate file in a directory, skipping hidden directories (e.g. a content index) and anything that isn't a debate.
+# If given start and/or end dates (YYYY-MM-DD), only partitions that overlap them are looked in.
+def get_debate_files(dir_fp, start=None, end=None):
+    for subdir, dirs, files in os.walk(dir_fp):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and partition_in_range(subdir, d, start, end)]
+        for filename in files:
+            if is_debate_file(filename) and file_in_range(filename, start, end):
+                yield os.path.join(subdir, filename).replace("\\", "/")
+
+
+# Makes every contribution by the same member share one member dict, rather than each having its own copy.
+def intern_member(members, contribution):
+    member = contribution.get('member')
+    if member is not None:
+        key = (member['member_name'], member['member_id'], member['member_mnis'], member['member_xid'])
+        contribution['member'] = members.setdefault(key, member)
+    return contribution
+
+
+# Only keeps the given fields of a contribution (all of them if fields is None).
+def select_fields(contribution, fields):
+    if fields is None:
+        return contribution
+    return {field: contribution.get(field) for field in fields}
+
+
+# Yields each contribution in a debate file, in order.
+# .ndjson files are read a line at a time, so only one contribution needs to be in memory at once.
+def iter_contributions(fp, fields=None):
+    members = dict()
+    if fp.endswith(FORMATS['ndjson']):
+        with open(fp) as debate_file:
+            for line in debate_file:
+                if line.strip():
+                    yield select_fields(intern_member(members, json.loads(line)), fields)
+    else:
+        with open(fp) as debate_file:
+            debate = json.load(debate_file)
+        for contribution in debate.values():
+            yield select_fields(intern_member(members, contribution), fields)
+
+
+# Gets the first contribution in a debate file (None if it's empty).
+def get_first_contribution(fp, fields=None):
+    return next(iter_contributions(fp, fields), None)
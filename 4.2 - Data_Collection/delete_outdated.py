@@ -3,6 +3,8 @@ import re
 import sys
 from datetime import datetime
 
+from processing_manifest import get_manifest_fp, open_manifest, get_sittings, delete_sitting
+
 in_dir = sys.argv[1]
 
 start_date = sys.argv[2]
@@ -10,13 +12,33 @@ start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
 end_date = sys.argv[3]
 end_datetime = datetime.strptime(end_date, '%Y-%m-%d')
 
+# If there's a manifest (from remove_duplicates.py), the dates come from that and it's kept up to date.
+manifest_fp = get_manifest_fp(in_dir)
+manifest = open_manifest(manifest_fp) if os.path.isfile(manifest_fp) else None
+sitting_dates = dict()
+if manifest is not None:
+    sitting_dates = {sitting['file']: sitting['date'] for sitting in get_sittings(manifest)}
+
 for subdir, dirs, files in os.walk(in_dir):
     for filename in files:
         curr_file = os.path.join(subdir, filename)
 
-        curr_date = re.match(r"(\d+\-\d+\-\d+)\-.*", filename).group(1)
+        if filename in sitting_dates:
+            curr_date = sitting_dates[filename]
+        else:
+            m = re.match(r"(\d+\-\d+\-\d+)\-.*", filename)
+            # Not a debate (e.g. the manifest itself).
+            if m is None:
+                continue
+            curr_date = m.group(1)
         curr_datetime = datetime.strptime(curr_date, '%Y-%m-%d')
 
         if curr_datetime > end_datetime or curr_datetime < start_datetime:
             print("{0} - {1}".format(curr_date, curr_datetime))
-            os.remove(curr_file)
\ No newline at end of file
+            os.remove(curr_file)
+            if manifest is not None:
+                delete_sitting(manifest, filename)
+
+if manifest is not None:
+    manifest.commit()
+    manifest.close()
@@ -0,0 +1,115 @@
+# Keeps a record of every entry we've seen in the parliament feed and what happened to it.
+# This lets download_zips.py top up the zip directory without fetching everything again.
+import os
+import sqlite3
+from datetime import datetime
+
+
+sql_create_entries = """
+CREATE TABLE IF NOT EXISTS entries (
+    link text PRIMARY KEY,
+    title text,
+    updated text,
+    size integer,
+    etag text,
+    last_modified text,
+    local_path text,
+    status text NOT NULL
+);"""
+
+sql_create_syncs = """
+CREATE TABLE IF NOT EXISTS syncs (
+    fromdate text NOT NULL,
+    todate text NOT NULL,
+    synced_at text NOT NULL
+);"""
+
+
+def open_manifest(fp):
+    connection = sqlite3.connect(fp)
+    connection.execute(sql_create_entries)
+    connection.execute(sql_create_syncs)
+    connection.commit()
+    return connection
+
+
+# Gets the size of the zip the feed says it's linking to (if it says).
+def get_entry_size(entry):
+    for link in entry.get('links', []):
+        if link.get('href') == entry['link'] and link.get('length'):
+            try:
+                return int(link['length'])
+            except ValueError:
+                return None
+    return None
+
+
+def get_entry(connection, link):
+    command = '''SELECT link, title, updated, size, etag, last_modified, local_path, status
+                FROM entries WHERE link = ?;'''
+    row = connection.execute(command, (link,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(["link", "title", "updated", "size", "etag", "last_modified", "local_path", "status"], row))
+
+
+# Checks whether a feed entry is new, or has changed since we downloaded it.
+def is_new_or_changed(connection, entry):
+    seen = get_entry(connection, entry['link'])
+    if seen is None or seen['status'] != "done":
+        return True
+
+    # If the file has gone missing we need it again.
+    if seen['local_path'] is None or not os.path.isfile(seen['local_path']):
+        return True
+
+    # The feed tells us when it was updated and how big it is, so check them.
+    if entry.get('updated') != seen['updated']:
+        return True
+    size = get_entry_size(entry)
+    if size is not None and seen['size'] is not None and size != seen['size']:
+        return True
+
+    return False
+
+
+# Records an entry from the feed. Anything we already know about keeps its download info.
+def record_entry(connection, entry, local_path, status="pending"):
+    command = '''INSERT INTO entries(link, title, updated, size, local_path, status)
+                VALUES(?, ?, ?, ?, ?, ?)
+                ON CONFLICT(link) DO UPDATE SET title=excluded.title, updated=excluded.updated,
+                size=excluded.size, local_path=excluded.local_path, status=excluded.status;'''
+    curr_entry = (entry['link'], entry.get('title'), entry.get('updated'),
+                    get_entry_size(entry), local_path, status)
+    connection.execute(command, curr_entry)
+
+
+# Records the result of trying to download an entry.
+def record_download(connection, link, out_fp, headers):
+    if out_fp is None:
+        connection.execute("UPDATE entries SET status = 'failed' WHERE link = ?;", (link,))
+        return
+
+    if headers is None:
+        headers = {}
+    command = '''UPDATE entries SET status = 'done', local_path = ?,
+                etag = coalesce(?, etag), last_modified = coalesce(?, last_modified),
+                size = coalesce(size, ?)
+                WHERE link = ?;'''
+    curr_entry = (out_fp, headers.get("ETag"), headers.get("Last-Modified"),
+                    os.path.getsize(out_fp), link)
+    connection.execute(command, curr_entry)
+
+
+def record_sync(connection, fromdate, todate):
+    command = '''INSERT INTO syncs(fromdate, todate, synced_at)
+                VALUES(?, ?, ?);'''
+    connection.execute(command, (fromdate, todate, datetime.now().isoformat()))
+
+
+# Gets the date the last sync went up to, so we know where to start from.
+def get_last_synced(connection):
+    row = connection.execute("SELECT max(todate) FROM syncs;").fetchone()
+    if row[0] is None:
+        return None
+    return datetime.strptime(row[0], "%Y-%m-%d").date()
@@ -1,14 +1,31 @@
 import os
+import sys
+import time
 import feedparser
 import requests
-import wget
 
+from http_cache import fetch
+from download_manifest import open_manifest, get_entry, is_new_or_changed, record_entry, \
+                                record_download, record_sync, get_last_synced
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import timedelta, date
 from dateutil import rrule
 
 
-def get_atom_resources(url):
-    resources = feedparser.parse(url)
+# Number of zips to download at the same time.
+N_WORKERS = 8
+# How many times to try a url before giving up on it, and how long to wait between tries.
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 2
+# Size of the pieces we write to disk as the download streams in.
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 60
+
+
+# Reads the feed through the cache. Use a ttl of 0 to always check for a newer version.
+def get_atom_resources(url, ttl=None):
+    resources = feedparser.parse(fetch(url, ttl=ttl))
     for entry in resources['entries']:
         yield entry
 
@@ -17,30 +34,124 @@ def add_to_discard_pile(url):
     with open("zip_discard_pile.txt", "a") as discard_pile:
         discard_pile.write("{}\n".format(url))
 
+# Gets the path a url should be downloaded to.
+def get_zip_fp(url, out_dir):
+    return "{0}/{1}".format(out_dir, url.split("/")[-1])
+
+# Streams the file at the url into the part file and returns the response headers.
+# If the part file already has some of the file in it, we ask the server for the rest.
+def fetch_part(url, part_fp):
+    done = os.path.getsize(part_fp) if os.path.isfile(part_fp) else 0
+    headers = {"Range": "bytes={}-".format(done)} if done else {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        # The server can't give us anything past the end, so check if we already have it all.
+        if response.status_code == 416:
+            total = response.headers.get("Content-Range", "").split("/")[-1]
+            if total.isdigit() and int(total) == done:
+                return response.headers
+            # Otherwise the part file is no good, so start again.
+            os.remove(part_fp)
+            raise IOError("Could not resume {}".format(url))
+
+        response.raise_for_status()
+
+        # If the server ignored the range, it's sending the whole thing again.
+        if response.status_code == 206:
+            mode = "ab"
+        else:
+            mode = "wb"
+            done = 0
+
+        expected = response.headers.get("Content-Length")
+        written = 0
+        with open(part_fp, mode) as part_file:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                part_file.write(chunk)
+                written += len(chunk)
+
+    # Leave the part file where it is so the next try picks up from here.
+    if expected is not None and written < int(expected):
+        raise IOError("Only got {0} of {1} bytes from {2}".format(done + written, done + int(expected), url))
+
+    return response.headers
+
 # Downloads the file at the given url to the given directory.
-def download_zip(url, out_dir):
-    try:
-        wget.download(url, "{0}/{1}".format(out_dir, url.split("/")[-1]))
-    except Exception as e:
-        print(e)
-        add_to_discard_pile(url)
-
-def download_zips(resources, out_dir):
+# Retries with backoff, resuming from the part file each time.
+# Returns where it was saved (None if it failed) and the response headers.
+def download_zip(url, out_dir, retries=MAX_RETRIES, backoff=BACKOFF_SECONDS):
+    out_fp = get_zip_fp(url, out_dir)
+    part_fp = "{}.part".format(out_fp)
+
+    # Don't bother if we already have it.
+    if os.path.isfile(out_fp):
+        return out_fp, None
+
+    for attempt in range(retries):
+        try:
+            headers = fetch_part(url, part_fp)
+            os.replace(part_fp, out_fp)
+            return out_fp, headers
+        except Exception as e:
+            print("Attempt {0} at {1} failed: {2}".format(attempt + 1, url, e))
+            if attempt < retries - 1:
+                time.sleep(backoff * (2 ** attempt))
+
+    add_to_discard_pile(url)
+    return None, None
+
+# Gets the zip urls out of the feed entries.
+def get_zip_entries(resources):
     # Loop through all of the resources in the feed
     for entry in resources:
         # Find the file extension (which will tell us the type of resource)
         extension = entry['link'].split(".")[-1].strip()
 
-        # Record the resource url.
-        r_url = entry['link']
-
         # Catch the zip files.
         if extension == "zip":
-            print("\n\n---------------------------")
-            print(entry['title'])
-            print("---------------------------\n")
-
-            download_zip(r_url, out_dir)
+            yield entry
+
+# Downloads all the (url, out_dir) pairs using a pool of threads.
+# If given a manifest, the result of each download is recorded in it (from this thread only).
+def download_all(jobs, n_workers=N_WORKERS, manifest=None):
+    downloaded = []
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = {pool.submit(download_zip, url, out_dir): url for url, out_dir in jobs}
+        for future in as_completed(futures):
+            out_fp, headers = future.result()
+            if manifest is not None:
+                record_download(manifest, futures[future], out_fp, headers)
+                manifest.commit()
+            if out_fp is not None:
+                print("Downloaded {}".format(out_fp))
+                downloaded.append(out_fp)
+    return downloaded
+
+# Works out whether a feed entry needs downloading to zip_fp.
+# Entries are only recorded in the manifest when they're going to be downloaded, so a copy we already had
+# (which could be older than the entry) is never taken to match the entry.
+def needs_download(manifest, entry, zip_fp, sync=False):
+    # Without --sync, any copy we already have is kept. It isn't recorded, so a later --sync will still check it.
+    if not sync:
+        return not os.path.isfile(zip_fp)
+
+    if not is_new_or_changed(manifest, entry):
+        return False
+
+    # If it has changed (or we don't know where the copy we have came from), get rid of it so it is downloaded again.
+    old_fps = [zip_fp]
+    seen = get_entry(manifest, entry['link'])
+    if seen is not None and seen['local_path'] is not None:
+        old_fps.append(seen['local_path'])
+    for old_fp in old_fps:
+        for curr_fp in [old_fp, "{}.part".format(old_fp)]:
+            if os.path.isfile(curr_fp):
+                os.remove(curr_fp)
+    return True
+
+def download_zips(resources, out_dir, n_workers=N_WORKERS):
+    jobs = [(entry['link'], out_dir) for entry in get_zip_entries(resources)]
+    return download_all(jobs, n_workers)
 
 # Given the two given dates, gives a formatted beginning and end.
 def get_month_boundaries(t1, t2):
@@ -54,13 +165,18 @@ def get_month_boundaries(t1, t2):
 # Get a time range comprising entire months from beginning to end.
 def get_times(start, end):
     # Get the start of the next month after the start time.
-    start_of_full_months = date(year=start.year, 
-                                month=(start.month % 12) + 1, 
+    start_of_full_months = date(year=start.year + (start.month // 12),
+                                month=(start.month % 12) + 1,
                                 day=1)
 
     # Get all intermediary times (i.e. the whole months)
     all_times = [dt for dt in rrule.rrule(rrule.MONTHLY, dtstart=start_of_full_months, until=end)]
-    
+
+    # If there aren't any, the whole range is within one month.
+    if len(all_times) == 0:
+        yield get_month_boundaries(start, end + timedelta(days=1))
+        return
+
     # Yield the remainder of the first month. (beginning/end)
     yield get_month_boundaries(start, all_times[0])
 
@@ -71,20 +187,62 @@ def get_times(start, end):
     # Return the beginning/end for the final month.
     yield get_month_boundaries(all_times[-1], end + timedelta(days=1))
 
+def get_feed_url(t):
+    return "http://api.data.parliament.uk/resources/files/feed?skip=0&take=all&fromdate={0}&todate={1}".format(t[0], t[1])
+
 if __name__ == "__main__":
     # Originally go 2015/05/07 -> 2019/09/10
     start = date(year=2019, month=6, day=1)
     end = date(year=2020, month=1, day=1)
 
-    out_dir = input("Enter Directory: ")
-    
+    # With --sync, only download entries that are new or have changed since the last run.
+    sync = "--sync" in sys.argv
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    if len(args) > 0:
+        out_dir = args[0]
+    else:
+        out_dir = input("Enter Directory: ")
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    manifest = open_manifest(os.path.join(out_dir, "manifest.db"))
+
+    if sync:
+        # Start from the beginning of the month we last got up to, as it may have been partial.
+        last_synced = get_last_synced(manifest)
+        if last_synced is not None:
+            start = last_synced.replace(day=1)
+        end = date.today()
+
+    # Collect every zip from every month first, so the pool can work across months.
+    jobs = []
     for t in get_times(start, end):
-        url = "http://api.data.parliament.uk/resources/files/feed?skip=0&take=all&fromdate={0}&todate={1}".format(t[0], t[1])
-        
+        url = get_feed_url(t)
+
         # curr_dir = "hansard_zips/{}".format(t[0])
         curr_dir = "{0}/{1}".format(out_dir, t[0])
         if not os.path.isdir(curr_dir):
             os.makedirs(curr_dir)
 
-        resources = get_atom_resources(url)
-        download_zips(resources, curr_dir)
\ No newline at end of file
+        # When syncing, the feed has to be checked with the server even if we have it cached.
+        feed_ttl = 0 if sync else None
+        for entry in get_zip_entries(get_atom_resources(url, ttl=feed_ttl)):
+            zip_fp = get_zip_fp(entry['link'], curr_dir)
+
+            if not needs_download(manifest, entry, zip_fp, sync):
+                continue
+
+            print(entry['title'])
+            record_entry(manifest, entry, zip_fp)
+            jobs.append((entry['link'], curr_dir))
+
+    manifest.commit()
+    print("{} zips to download".format(len(jobs)))
+
+    download_all(jobs, manifest=manifest)
+
+    record_sync(manifest, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+    manifest.commit()
+    manifest.close()
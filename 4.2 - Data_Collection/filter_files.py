@@ -2,52 +2,235 @@ import os
 import zipfile
 import re
 import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+from content_index import get_index_dir, spool_and_hash, claim, settle_claims
+from object_store import add_stream, link_file
+
+
+# Inner zips bigger than this (uncompressed) are spilled to a temporary file instead of being held in memory.
+SPILL_THRESHOLD = 16 * 1024 * 1024
+# Size of the pieces we copy inner zips in.
+CHUNK_SIZE = 1024 * 1024
+
+chan_re = re.compile(r'CHAN\d+\.xml')
+
+
+# Opens up a zip inside a zip so it can be read as an archive of its own.
+# Small ones are read into memory, big ones are streamed to a temporary file.
+def open_inner_zip(curr_archive, file_info, spill_threshold=SPILL_THRESHOLD):
+    with curr_archive.open(file_info) as curr_file:
+        if file_info.file_size <= spill_threshold:
+            return BytesIO(curr_file.read())
+
+        spill_file = tempfile.TemporaryFile()
+        shutil.copyfileobj(curr_file, spill_file, CHUNK_SIZE)
+        spill_file.seek(0)
+        return spill_file
 
 
 # Recursively finds all the Commons XML files in a zipped folder.
-def findXML(curr_archive, filename):    
+# Each inner zip is closed before we move on to the next, so only one is open at each level.
+# If given a summary dict, the number of files and bytes extracted are added to it.
+# If given an index directory, each xml is hashed as it streams out and is only written if it's the newest copy of
+# those bytes so far (rank is the archive's id). Each claim is added to the summary, to be settled once all are done.
+# If given a store directory, each xml is written to the object store and linked into place.
+def findXML(curr_archive, filename, summary=None, index_dir=None, store_dir=None, rank=-1):
     # For each file in the zip archive
     for file_info in curr_archive.infolist():
-        # Open current file.
-        with curr_archive.open(file_info) as curr_file:
-            # If it's a zip, open that up and search that for XMLs.
-            if ".zip" in curr_file.name:
-                #new_filename = "{0}/{1}".format(filename, curr_file.name.split(".")[0])
-                # We have to read in bytes because that is what ZipFile wants to take.
-                curr_file_bytes = BytesIO(curr_file.read())
-                with zipfile.ZipFile(curr_file_bytes, "r") as next_archive:
-                    findXML(next_archive, filename)
-            # If the file is a Commons xml file, then extract it.
-            elif re.fullmatch(r'CHAN\d+\.xml', curr_file.name):
-                # Work out file name.
-                new_filename = "{0}/{1}".format(filename, curr_file.name)
+        # If it's a zip, open that up and search that for XMLs.
+        if ".zip" in file_info.filename:
+            #new_filename = "{0}/{1}".format(filename, curr_file.name.split(".")[0])
+            with open_inner_zip(curr_archive, file_info) as inner_file:
+                with zipfile.ZipFile(inner_file, "r") as next_archive:
+                    findXML(next_archive, filename, summary, index_dir, store_dir, rank)
+        # If the file is a Commons xml file, then extract it.
+        elif chan_re.fullmatch(file_info.filename):
+            # Work out file name.
+            new_filename = "{0}/{1}".format(filename, file_info.filename)
+
+            if index_dir is None and store_dir is None:
                 # Extract to the new file.
                 curr_archive.extract(file_info, new_filename)
-                print("Extracting {}".format(curr_file.name))
-                print("Writing to {}".format(new_filename))
+            else:
+                # This is where extract would have put it.
+                out_fp = "{0}/{1}".format(new_filename, file_info.filename)
+                with curr_archive.open(file_info) as xml_file:
+                    digest, spooled = spool_and_hash(xml_file)
+
+                with spooled:
+                    # If we've already got a newer copy of these bytes, this one is just an alias of it.
+                    if index_dir is not None:
+                        first_fp, replaced_fp = claim(index_dir, digest, out_fp, rank)
+                        if summary is not None:
+                            summary['claims'].append((out_fp, digest, replaced_fp, file_info.file_size))
+                        if first_fp != out_fp:
+                            print("Skipping {0}, it is the same as {1}".format(out_fp, first_fp))
+                            continue
+
+                    os.makedirs(new_filename, exist_ok=True)
+                    if store_dir is not None:
+                        link_file(add_stream(store_dir, digest, spooled), out_fp)
+                    else:
+                        with open(out_fp, "wb") as out_file:
+                            shutil.copyfileobj(spooled, out_file, CHUNK_SIZE)
+
+            print("Extracting {}".format(file_info.filename))
+            print("Writing to {}".format(new_filename))
+
+            # With an index, what's counted depends on which copies are kept in the end (see settle_archives).
+            if summary is not None and index_dir is None:
+                summary['files'] += 1
+                summary['bytes'] += file_info.file_size
+
+# Recursively finds all the Commons XML files in a zipped folder, but rather than extracting them
+# yields each one's name along with an open stream of it.
+def iter_xmls(curr_archive):
+    for file_info in curr_archive.infolist():
+        if ".zip" in file_info.filename:
+            with open_inner_zip(curr_archive, file_info) as inner_file:
+                with zipfile.ZipFile(inner_file, "r") as next_archive:
+                    yield from iter_xmls(next_archive)
+        elif chan_re.fullmatch(file_info.filename):
+            with curr_archive.open(file_info) as xml_file:
+                yield file_info.filename, xml_file
 
 # Function that kicks off all the lovely recursion.
-def find_all_xmls(zip_dir, filename):
+def find_all_xmls(zip_dir, filename, summary=None, index_dir=None, store_dir=None):
     with zipfile.ZipFile(zip_dir, "r") as curr_archive:
-        findXML(curr_archive, filename)
+        findXML(curr_archive, filename, summary, index_dir, store_dir, get_archive_id((zip_dir,)))
+
+# Same as find_all_xmls, but also reports the peak memory used while doing it.
+def find_all_xmls_with_memory(zip_dir, filename, summary=None, index_dir=None, store_dir=None):
+    tracemalloc.start()
+    try:
+        find_all_xmls(zip_dir, filename, summary, index_dir, store_dir)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    print("Peak memory for {0}: {1:.1f} MB".format(zip_dir, peak / (1024 * 1024)))
+    return peak
+
+# Extracts a single archive and returns a summary of what was done.
+# This is what each worker runs when extracting in parallel.
+def extract_archive(zip_fp, out_fp, report_memory=False, index_dir=None, store_dir=None):
+    if not os.path.isdir(out_fp):
+        os.makedirs(out_fp, exist_ok=True)
+
+    summary = {"archive": zip_fp, "files": 0, "aliases": 0, "bytes": 0, "seconds": 0.0, "peak_memory": None, "claims": []}
+    start_time = time.perf_counter()
+    if report_memory:
+        summary['peak_memory'] = find_all_xmls_with_memory(zip_fp, out_fp, summary, index_dir, store_dir)
+    else:
+        find_all_xmls(zip_fp, out_fp, summary, index_dir, store_dir)
+    summary['seconds'] = time.perf_counter() - start_time
+
+    return summary
+
+# Gets the id number at the start of a zip's name (-1 if it doesn't have one).
+def get_archive_id(archive):
+    m = re.match(r"(\d+)", os.path.basename(archive[0]))
+    return int(m.group(1)) if m else -1
+
+# Gets every zip in the directory along with the directory its xmls should go in.
+# Sorted, so the order (and the summary) is the same on every run.
+# The newest (highest id) zips come first, so when there are byte-identical copies it's the newest we keep.
+def get_all_archives(in_dir, out_dir):
+    archives = []
+    for subdir, dirs, files in os.walk(in_dir):
+        for filename in files:
+            # Skip anything that isn't a finished zip (e.g. the download manifest or .part files).
+            if not filename.endswith(".zip"):
+                continue
+
+            curr_fp = os.path.join(subdir, filename).replace("\\", "/")
+            out_fp = os.path.join(out_dir, re.match(r'.*[\\\/](\d\d\d\d\-\d\d\-\d\d)[\\\/].*', curr_fp).group(1), filename.split(".")[0])
+            archives.append((curr_fp, out_fp))
+    return sorted(sorted(archives), key=get_archive_id, reverse=True)
+
+# Removes an xml that turned out not to be the copy kept, and its directory if that's now empty.
+def remove_xml(out_fp):
+    if os.path.lexists(out_fp):
+        os.remove(out_fp)
+        try:
+            os.rmdir(os.path.dirname(out_fp))
+        except OSError:
+            pass
+
+# Once every archive has been extracted, settles who kept which bytes (in archive order, so aliases.tsv is the
+# same every time), removes the copies that lost, and counts the files and aliases for each archive.
+def settle_archives(summaries, index_dir):
+    claims = [(out_fp, digest, replaced_fp) for summary in summaries for out_fp, digest, replaced_fp, size in summary['claims']]
+    kept = settle_claims(index_dir, claims, remove_xml)
+    for summary in summaries:
+        for out_fp, digest, replaced_fp, size in summary['claims']:
+            if out_fp in kept:
+                summary['files'] += 1
+                summary['bytes'] += size
+            else:
+                summary['aliases'] += 1
+
+# Extracts all the archives, fanning them out over a pool of processes if n_workers > 1.
+def extract_all(archives, n_workers=1, report_memory=False, index_dir=None, store_dir=None):
+    zip_fps = [a[0] for a in archives]
+    out_fps = [a[1] for a in archives]
+    memory_flags = [report_memory] * len(archives)
+    index_dirs = [index_dir] * len(archives)
+    store_dirs = [store_dir] * len(archives)
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            summaries = list(pool.map(extract_archive, zip_fps, out_fps, memory_flags, index_dirs, store_dirs))
+    else:
+        summaries = list(map(extract_archive, zip_fps, out_fps, memory_flags, index_dirs, store_dirs))
+
+    if index_dir is not None:
+        settle_archives(summaries, index_dir)
+    return summaries
+
+def print_summary(summaries):
+    print("\n{0:<60} {1:>8} {2:>8} {3:>14} {4:>10}".format("Archive", "Files", "Aliases", "Bytes", "Seconds"))
+    for summary in summaries:
+        print("{0:<60} {1:>8} {2:>8} {3:>14} {4:>10.2f}".format(summary['archive'], summary['files'], summary['aliases'],
+                                                                summary['bytes'], summary['seconds']))
+    print("{0:<60} {1:>8} {2:>8} {3:>14}".format("Total", sum(s['files'] for s in summaries),
+                                                    sum(s['aliases'] for s in summaries),
+                                                    sum(s['bytes'] for s in summaries)))
 
 # Main method - gets all those pesky xmls and writes them to files.
 if __name__ == "__main__":
+    # Use --report-memory to print the peak memory used for each archive.
+    # Use --workers=N to extract N archives at a time.
+    # Use --no-dedupe to extract every xml, even ones whose bytes we've already extracted.
+    # Use --store=DIR to keep the xml in a content-addressed store and hard link it into the dump directory.
+    report_memory = "--report-memory" in sys.argv
+    dedupe = "--no-dedupe" not in sys.argv
+    n_workers = 1
+    store_dir = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--workers="):
+            n_workers = int(arg.split("=")[1])
+        elif arg.startswith("--store="):
+            store_dir = arg.split("=", 1)[1]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
     # the directories we are working with.
-    if len(sys.argv) > 1:
-        in_dir = sys.argv[1]
-        out_dir = sys.argv[2]
+    if len(args) > 1:
+        in_dir = args[0]
+        out_dir = args[1]
     else:
         in_dir = input("Enter Zip Directory: ")
         out_dir = input("Enter Dump Directory")
 
-    # iterate through all files and call the find_all_xmls function.
-    for subdir, dirs, files in os.walk(in_dir):
-        for filename in files:
-            curr_fp = os.path.join(subdir, filename).replace("\\", "/")
-            out_fp = os.path.join(out_dir, re.match(r'.*[\\\/](\d\d\d\d\-\d\d\-\d\d)[\\\/].*', curr_fp).group(1), filename.split(".")[0])
-            if not os.path.isdir(out_fp):
-                os.makedirs(out_fp)
+    # Find all the archives and extract the xmls from each.
+    archives = get_all_archives(in_dir, out_dir)
+    index_dir = get_index_dir(out_dir) if dedupe else None
+    summaries = extract_all(archives, n_workers, report_memory, index_dir, store_dir)
 
-            find_all_xmls(curr_fp, out_fp)
+    print_summary(summaries)
@@ -0,0 +1,102 @@
+# An on-disk cache for the parliament feed and the members data platform.
+# Responses are kept by url, so rebuilding the database doesn't ask for the same things again.
+# The settings can be changed with these environment variables:
+#   HANSARD_CACHE_DIR -> where to keep the responses.
+#   HANSARD_CACHE_TTL -> how many seconds a response is fresh for before we check it again.
+#   HANSARD_OFFLINE   -> if set to 1, never go to the network and only use what's in the cache.
+import os
+import json
+import time
+import hashlib
+import requests
+
+
+CACHE_DIR = os.environ.get("HANSARD_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "http_cache"))
+TTL = int(os.environ.get("HANSARD_CACHE_TTL", 7 * 24 * 60 * 60))
+OFFLINE = os.environ.get("HANSARD_OFFLINE", "0") not in ("", "0")
+TIMEOUT = 60
+
+
+# Gets the paths of the body and the metadata for a url.
+def get_cache_fps(url, cache_dir):
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "{}.body".format(key)), os.path.join(cache_dir, "{}.json".format(key))
+
+
+def read_cached(body_fp, meta_fp):
+    if not (os.path.isfile(body_fp) and os.path.isfile(meta_fp)):
+        return None, None
+
+    with open(meta_fp) as meta_file:
+        meta = json.load(meta_file)
+    with open(body_fp, "rb") as body_file:
+        body = body_file.read()
+    return body, meta
+
+
+# Writes to a temporary file first so a half written response never ends up in the cache.
+def write_atomic(fp, data, mode="wb"):
+    tmp_fp = "{0}.{1}.tmp".format(fp, os.getpid())
+    with open(tmp_fp, mode) as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_fp, fp)
+
+
+def write_meta(meta_fp, meta):
+    write_atomic(meta_fp, json.dumps(meta), mode="w")
+
+
+# Gets the content at the url, from the cache if we can.
+# Anything older than the ttl is revalidated with the server using its ETag/Last-Modified.
+def fetch(url, ttl=None, offline=None, cache_dir=None):
+    ttl = TTL if ttl is None else ttl
+    offline = OFFLINE if offline is None else offline
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    body_fp, meta_fp = get_cache_fps(url, cache_dir)
+    body, meta = read_cached(body_fp, meta_fp)
+
+    if offline:
+        if body is None:
+            raise IOError("Offline and {} is not in the cache".format(url))
+        return body
+
+    # If it is still fresh, don't bother asking.
+    if body is not None and time.time() - meta['fetched_at'] < ttl:
+        return body
+
+    # Otherwise ask the server if it has changed.
+    headers = dict()
+    if body is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = requests.get(url, headers=headers, timeout=TIMEOUT)
+    except requests.RequestException as e:
+        # Better to give back something old than nothing at all.
+        if body is not None:
+            print("Could not revalidate {0}, using the cached copy: {1}".format(url, e))
+            return body
+        raise
+
+    if response.status_code == 304 and body is not None:
+        meta['fetched_at'] = time.time()
+        write_meta(meta_fp, meta)
+        return body
+
+    response.raise_for_status()
+
+    meta = {"url": url,
+            "fetched_at": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")}
+    write_atomic(body_fp, response.content)
+    write_meta(meta_fp, meta)
+
+    return response.content
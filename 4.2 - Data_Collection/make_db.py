@@ -1,12 +1,14 @@
 import sys
 import os
 import re
-import json
 
 import sqlite3
 from sqlite3 import Error as SQLError
 from datetime import datetime
-from lxml import etree
+from itertools import chain
+from mnis_members import load_members, get_member_index, add_to_member_index, find_member, get_member_info
+from debate_io import get_debate_files, iter_contributions
+from processing_manifest import read_sittings
 
 
 # All the SQL code was taken from:
@@ -44,95 +46,203 @@ def create_table(conn, create_table_sql):
         print(e)
 
 
-def get_all_debates(dir_fp):
-    # Loop through all files and yield one file name at a time.
-    for subdir, dirs, files in os.walk(dir_fp):
-        for filename in files:
-            curr_fp = os.path.join(subdir, filename)
-            with open(curr_fp) as curr_file:
-                curr_debate = json.load(curr_file)
-            yield curr_debate
+sql_create_contributions = """
+CREATE TABLE IF NOT EXISTS contributions (
+    uid integer PRIMARY KEY,
+    member integer NOT NULL,
+    debate integer NOT NULL,
+    body text NOT NULL,
+    isQuestion integer NOT NULL,
+    referringTo integer,
+    topic text,
+    section text,
+    contType text,
+    sectionTag text,
+    department text,
+    FOREIGN KEY (member) REFERENCES members (PimsId)
+    FOREIGN KEY (debate) REFERENCES debates (id)
+);"""
+
+# id is what contributions refer to the debate by. uid is the hansard file name (e.g. 100005-CHAN1).
+sql_create_debates = """
+CREATE TABLE IF NOT EXISTS debates (
+    id integer PRIMARY KEY,
+    uid text NOT NULL UNIQUE,
+    date text,
+    hansardNum text,
+    file text
+);"""
+
+sql_create_members = """
+CREATE TABLE IF NOT EXISTS members (
+    PimsId integer PRIMARY KEY,
+    MnisId integer,
+    ClerksId integer,
+    name text,
+    curr_party text,
+    curr_constituency text,
+    member_since text,
+    member_until text
+);"""
+
+sql_create_member_party = """
+CREATE TABLE IF NOT EXISTS member_party (
+    PimsId integer NOT NULL,
+    start text NOT NULL,
+    end text,
+    party text NOT NULL,
+    PRIMARY KEY (PimsId, start),
+    FOREIGN KEY (PimsId) REFERENCES members (PimsId)
+);"""
+
+sql_create_member_constituency = """
+CREATE TABLE IF NOT EXISTS member_constituency (
+    PimsId integer NOT NULL,
+    start text NOT NULL,
+    end text,
+    constituency text NOT NULL,
+    PRIMARY KEY (PimsId, start),
+    FOREIGN KEY (PimsId) REFERENCES members (PimsId)
+);"""
+
+
+# Rows are inserted this many at a time, each lot in its own transaction.
+BATCH_SIZE = 5000
+# How often (in rows) to print how far we've got.
+PROGRESS_EVERY = 50000
+
+# Settings to make building the database quicker.
+# There's no journal, so if the build is stopped part way through the database should be made again from scratch.
+sql_load_pragmas = ["PRAGMA journal_mode = OFF;",
+                    "PRAGMA synchronous = OFF;",
+                    "PRAGMA cache_size = -262144;",
+                    "PRAGMA temp_store = MEMORY;"]
+
+# The usual settings, for once the database has been built.
+sql_normal_pragmas = ["PRAGMA journal_mode = DELETE;",
+                      "PRAGMA synchronous = FULL;"]
+
+# Indexes are made once everything is in, which is quicker than keeping them up to date on every insert.
+# They're for the joins and date filters in the analysis (e.g. sql_get_all_posts in the ACE scripts).
+sql_create_indexes = ["CREATE INDEX IF NOT EXISTS contributions_debate ON contributions (debate);",
+                      "CREATE INDEX IF NOT EXISTS contributions_member ON contributions (member);",
+                      "CREATE INDEX IF NOT EXISTS debates_date ON debates (date);",
+                      "CREATE INDEX IF NOT EXISTS member_party_dates ON member_party (PimsId, start, end);"]
+
+
+def create_tables(connection):
+    # Create Debates table
+    create_table(connection, sql_create_debates)
+    print("Created debates table.")
+
+    # Create Members table
+    create_table(connection, sql_create_members)
+    print("Created members table.")
+
+    # Create Contribution table
+    create_table(connection, sql_create_contributions)
+    print("Created contributions table.")
+
+    # Create Contribution table
+    create_table(connection, sql_create_member_party)
+    print("Created contributions table.")
+
+    # Create Contribution table
+    create_table(connection, sql_create_member_constituency)
+    print("Created contributions table.")
+
+
+def set_load_pragmas(connection):
+    for pragma in sql_load_pragmas:
+        connection.execute(pragma)
+
+
+def set_normal_pragmas(connection):
+    for pragma in sql_normal_pragmas:
+        connection.execute(pragma)
+
+
+def create_indexes(connection):
+    for command in sql_create_indexes:
+        connection.execute(command)
+    connection.commit()
+    print("Created indexes.")
+
+
+# Gathers the statistics SQLite uses to pick which index to use. Run again after adding tables (e.g. add_stances.py).
+def analyze_db(connection):
+    connection.execute("ANALYZE;")
+    connection.commit()
+
+
+# Inserts the rows BATCH_SIZE at a time, printing how far it's got every so often.
+# Returns the number of rows inserted (rows skipped by INSERT OR IGNORE aren't counted).
+def insert_rows(connection, command, rows, name="rows"):
+    changes_before = connection.total_changes
+    n_rows = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            with connection:
+                connection.executemany(command, batch)
+            n_rows += len(batch)
+            batch = []
+            if n_rows % PROGRESS_EVERY < BATCH_SIZE:
+                print("Added {0} {1}".format(n_rows, name))
+    if batch:
+        with connection:
+            connection.executemany(command, batch)
+    return connection.total_changes - changes_before
+
+
+def get_all_debates(dir_fp, start=None, end=None):
+    # Loop through all files and yield the contributions of one file at a time.
+    # Each debate is streamed a contribution at a time, so should only be gone through once.
+    # If given start and/or end dates (YYYY-MM-DD), only the debates between them are used.
+    for curr_fp in get_debate_files(dir_fp, start, end):
+        yield iter_contributions(curr_fp)
+
+# Gets the UID of the question a contribution answers (if any).
+# Older json has the whole question in there rather than just its UID.
+def get_question_uid(contribution):
+    question = contribution.get('question')
+    if isinstance(question, dict):
+        return question['uid']
+    return question
+
+# Adds the member to all_members if they haven't been seen before.
+# seen holds the (pims, mnis, xid) of everyone in all_members, so checking is quick however many there are.
+def add_member_key(all_members, seen, member):
+    key = (member['member_id'], member['member_mnis'], member['member_xid'])
+    if key not in seen:
+        seen.add(key)
+        all_members.append({"pims": key[0], "mnis": key[1], "xid": key[2]})
+
 
 def get_all_members(debates):
     all_members = list()
+    seen = set()
     for debate in debates:
-        for contribution in debate.values():
-            curr_member = contribution['member']
-            curr_member = {"pims":curr_member['member_id'], "mnis":curr_member['member_mnis'], "xid": curr_member['member_xid']}
-            if curr_member not in all_members:
-                all_members.append(curr_member)
+        for contribution in debate:
+            add_member_key(all_members, seen, contribution['member'])
     return all_members
 
-def get_full_mp_info(curr_member, members_xml):
-    num_chillens = len(members_xml)
-    for member in members_xml.iterfind("{*}Member"):
-        if curr_member['pims'] == member.attrib['Pims_Id'] or curr_member['mnis'] == member.attrib['Member_Id'] or curr_member['xid'] == member.attrib['Clerks_Id']:
-            out = dict()
 
-            # Get all the info about this user
-            # Have to do an if statement here because sometimes PimsId from the API is not real.
-            if member.attrib['Pims_Id'] == "":
-                out['PimsId'] = curr_member['pims']
-            else:
-                out["PimsId"] = member.attrib['Pims_Id']
-
-            out["ClerksId"] = member.attrib['Clerks_Id']
-            out["MnisId"] = member.attrib['Member_Id']
-            out["name"] = member.find("{*}DisplayAs").text
-            out["curr_party"] = member.find("{*}Party").text
-            out["curr_constituency"] = member.find("{*}MemberFrom").text
-            out["member_since"] = member.find("{*}HouseStartDate").text
-            out["member_until"] = member.find("{*}HouseEndDate").text
-
-            # Loop through all of the parties the MP has stood for
-            parties = []
-            parties_xml = member.find("{*}Parties")
-            # Add an entry for each one.
-            for party in parties_xml.iterfind("{*}Party"):
-                curr_party = dict()
-                curr_party['start'] = party.find("{*}StartDate").text
-                curr_party['end'] = party.find("{*}EndDate").text
-                curr_party['name'] = party.find("{*}Name").text
-                parties.append(curr_party)
-            out['parties'] = parties
-
-            # Loop through all of the constituencies the MP has represented.
-            constituencies = []
-            constituencies_xml = member.find("{*}Constituencies")
-            # Add an entry for each one.
-            for constituency in constituencies_xml.iterfind("{*}Constituency"):
-                curr_constituency = dict()
-                curr_constituency['start'] = constituency.find("{*}StartDate").text
-                curr_constituency['end'] = constituency.find("{*}EndDate").text
-                curr_constituency['name'] = constituency.find("{*}Name").text
-                constituencies.append(curr_constituency)
-            out['constituencies'] = constituencies
-
-            print("Collected data for {}".format(out["name"]))
-
-            return out
+def is_valid_member_id(member_id):
+    return not (member_id == "-1" or member_id is None or member_id == "")
 
+# Gets the MNIS information for each member, or None for anyone who can't be found.
+# All of it comes from a single download of every member (see mnis_members.py).
 def get_info_for_commons(members):
-    # create element tree object
-    all_members_tree = etree.parse("http://data.parliament.uk/membersdataplatform/services/mnis/members/query/House=Commons|Membership=all/Parties|Constituencies")
-
-    # get root element
-    all_members_root = all_members_tree.getroot()
-
-    # loop through each member and find their information
+    member_index = get_member_index(load_members())
     for member in members:
-        if member['mnis'] is not None:
-            curr_member_tree = etree.parse("http://data.parliament.uk/membersdataplatform/services/mnis/members/query/House=Commons|id={}|Membership=all/Parties|Constituencies".format(member['mnis']))
-            curr_member_root = curr_member_tree.getroot()
-            yield get_full_mp_info(member, curr_member_root)
-        else:
-            yield get_full_mp_info(member, all_members_root)
-    pass
+        yield get_member_info(member_index, member)
 
 
-def add_members(debates, connection):
-    members = get_info_for_commons(get_all_members(debates))
-    cursor = connection.cursor()
+# Looks up the members (as given by get_all_members) and adds them, returning what was found for each.
+def add_members(members, connection):
+    members = get_info_for_commons(members)
 
     # # Below is for testing if the thing is working properly.
     # all_members = [m for m in members]
@@ -146,8 +256,11 @@ def add_members(debates, connection):
     #     else:
     #         xxx[x['MnisId']].append(x)
 
-    already_added = []
+    already_added = set()
     all_members = []
+    member_rows = []
+    party_rows = []
+    constituency_rows = []
     for member in members:
         if member is None:
             continue
@@ -157,32 +270,43 @@ def add_members(debates, connection):
             continue
 
         all_members.append(member)
-        already_added.append(member['PimsId'])
+        already_added.add(member['PimsId'])
 
         # Add the member
-        command = '''INSERT INTO members(PimsId, MnisId, ClerksId, name, curr_party, curr_constituency, member_since, member_until)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?);'''
-        curr_entry = (member['PimsId'], member['MnisId'], member['ClerksId'],
-                        member['name'], member['curr_party'], member['curr_constituency'],
-                        member['member_since'], member['member_until'])
-        cursor.execute(command, curr_entry)
+        member_rows.append((member['PimsId'], member['MnisId'], member['ClerksId'],
+                            member['name'], member['curr_party'], member['curr_constituency'],
+                            member['member_since'], member['member_until']))
 
         # Add the member's parties
         for party in member['parties']:
-            command = '''INSERT INTO member_party(PimsId, start, end, party)
-                            VALUES(?, ?, ?, ?);'''
-            curr_entry = (member['PimsId'], party['start'], party['end'], party['name'])
-            cursor.execute(command, curr_entry)
+            party_rows.append((member['PimsId'], party['start'], party['end'], party['name']))
 
         # Add the member's constituencies
         for constituency in member['constituencies']:
-            command = '''INSERT INTO member_constituency(PimsId, start, end, constituency)
-                            VALUES(?, ?, ?, ?);'''
-            curr_entry = (member['PimsId'], constituency['start'], constituency['end'], constituency['name'])
-            cursor.execute(command, curr_entry)
+            constituency_rows.append((member['PimsId'], constituency['start'], constituency['end'], constituency['name']))
+
+    command = '''INSERT INTO members(PimsId, MnisId, ClerksId, name, curr_party, curr_constituency, member_since, member_until)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?);'''
+    insert_rows(connection, command, member_rows, "members")
+    command = '''INSERT INTO member_party(PimsId, start, end, party)
+                    VALUES(?, ?, ?, ?);'''
+    insert_rows(connection, command, party_rows, "parties")
+    command = '''INSERT INTO member_constituency(PimsId, start, end, constituency)
+                    VALUES(?, ?, ?, ?);'''
+    insert_rows(connection, command, constituency_rows, "constituencies")
+    print("Added {} members".format(len(all_members)))
     return all_members
 
 
+MEMBER_COLUMNS = ["PimsId", "MnisId", "ClerksId", "name", "curr_party", "curr_constituency", "member_since", "member_until"]
+
+
+# Gets every member in the database.
+def get_members(connection):
+    command = '''SELECT {} FROM members;'''.format(", ".join(MEMBER_COLUMNS))
+    return [dict(zip(MEMBER_COLUMNS, row)) for row in connection.execute(command)]
+
+
 # def add_members(debates, connection):
 #     members = dict()
 #     pims_mnis_map = dict()
@@ -246,40 +370,110 @@ def add_members(debates, connection):
 #         print(cursor.lastrowid)
 
 
-def add_debates(debates, connection):
-    cursor = connection.cursor()
+sql_insert_debate = '''INSERT INTO debates(uid, date, hansardNum, file)
+                    VALUES(?, ?, ?, ?);'''
+
+
+def get_debate_rows(debates):
     for debate in debates:
-        opener = list(debate.values())[0]
+        opener = next(debate)
         curr_datetime = datetime.strptime(opener['date'], '%d %B %Y')
         curr_hansard = re.match(r".*CHAN(\d+)", opener['hansard_file']).group(1)
         curr_uid = opener['hansard_file']
+        yield (curr_uid, curr_datetime, int(curr_hansard), opener['hansard_file'])
+
+
+# Gets the id of every debate in the table, by its uid (the hansard file name).
+def get_debate_ids(connection):
+    return dict(connection.execute("SELECT uid, id FROM debates;"))
 
-        command = '''INSERT INTO debates(uid, date, hansardNum, file)
-                    VALUES(?, ?, ?, ?);'''
-        curr_entry = (curr_uid, curr_datetime, int(curr_hansard), opener['hansard_file'])
-        cursor.execute(command, curr_entry)
-        print(cursor.lastrowid)
 
+# Gets the id of the debate the opener (its first contribution) is from, adding the debate if it isn't there yet.
+def get_debate_id(connection, debate_ids, opener):
+    if opener['hansard_file'] not in debate_ids:
+        cursor = connection.execute(sql_insert_debate, next(get_debate_rows([iter([opener])])))
+        debate_ids[opener['hansard_file']] = cursor.lastrowid
+    return debate_ids[opener['hansard_file']]
 
-def add_contributions(debates, members, connection):
-    cursor = connection.cursor()
+
+def add_debates(debates, connection):
+    n_rows = insert_rows(connection, sql_insert_debate, get_debate_rows(debates), "debates")
+    print("Added {} debates".format(n_rows))
+
+
+# Goes through the debates, adding each one to the debates table (if it isn't already) and noting who spoke,
+# and yields the contributions whose member has a PimsId. The rest can't be added until the members have been looked up, so go into pending.
+def walk_debates(debates, connection, debate_ids, all_members, seen_members, pending):
+    for debate in debates:
+        opener = next(debate, None)
+        if opener is None:
+            continue
+        get_debate_id(connection, debate_ids, opener)
+
+        for contribution in chain([opener], debate):
+            add_member_key(all_members, seen_members, contribution['member'])
+            if is_valid_member_id(contribution['member']['member_id']):
+                yield contribution
+            else:
+                pending.append(contribution)
+
+
+# Adds every debate and contribution from a single pass over the debates.
+# Debates already in the table (e.g. from the manifest) are used as they are.
+# Returns the members seen, ready for add_members, and the contributions that need adding once they've been added.
+def add_debates_and_contributions(debates, connection):
+    debate_ids = get_debate_ids(connection)
+    n_debates = len(debate_ids)
+    all_members = []
+    seen_members = set()
+    pending = []
+
+    contributions = walk_debates(debates, connection, debate_ids, all_members, seen_members, pending)
+    n_rows = insert_rows(connection, sql_insert_contribution, get_contribution_rows([contributions], debate_ids), "contributions")
+    print("Added {0} debates and {1} contributions".format(len(debate_ids) - n_debates, n_rows))
+    return all_members, pending
+
+
+# Adds the debates using the manifest rows, rather than opening each debate.
+# A sitting without a date (we couldn't read one from its first contribution) is left out here,
+# and add_debates_and_contributions adds it from its first contribution as it would without a manifest.
+def add_debates_from_manifest(sittings, connection):
+    rows = ((sitting['hansard_file'], datetime.strptime(sitting['date'], '%Y-%m-%d'), sitting['chan'], sitting['hansard_file'])
+            for sitting in sittings if sitting['date'] is not None)
+    n_rows = insert_rows(connection, sql_insert_debate, rows, "debates")
+    print("Added {} debates".format(n_rows))
+
+
+# Gets the manifest rows for the debates in the directory, or None if the manifest doesn't cover all of them.
+def get_manifest_sittings(dir_fp, start=None, end=None):
+    sittings = read_sittings(dir_fp)
+    if sittings is None:
+        return None
+
+    debate_files = set(os.path.basename(f) for f in get_debate_files(dir_fp, start, end))
+    sittings = [sitting for sitting in sittings if sitting['file'] in debate_files]
+    if len(sittings) != len(debate_files):
+        return None
+    return sittings
+
+
+# Gets a row for each contribution, skipping any we can't find the member for.
+# The debate is given by its id, from debate_ids (as from get_debate_ids).
+# Contributions without a PimsId are looked up in the member index (from get_member_index), if given one.
+def get_contribution_rows(debates, debate_ids, member_index=None):
     for debate in debates:
-        for contribution in debate.values():
+        for contribution in debate:
             if contribution['uid'] is None:
                 continue
 
             # By default, assume the listed PimsId is correct.
             member_id = contribution["member"]['member_id']
             # If it isn't, we'll need to find the right one.
-            if member_id == "-1" or member_id is None or member_id == "":
-                # find the PimsId based on their Mnis ID instead
-                for m in members:
-                    if m['MnisId'] == contribution['member']['member_mnis']:
-                        member_id = m['PimsId']
-                        break
-                    elif m['ClerksId'] == contribution['member']['member_xid']:
-                        member_id = m['PimsId']
-                        break
+            if not is_valid_member_id(member_id) and member_index is not None:
+                # find the PimsId based on their Mnis ID (or Clerks ID) instead
+                member = find_member(member_index, contribution['member']['member_mnis'], contribution['member']['member_xid'])
+                if member is not None:
+                    member_id = member['PimsId']
 
             if member_id == "-1" or member_id == "" or member_id is None:
                 continue
@@ -287,11 +481,7 @@ def add_contributions(debates, members, connection):
 
             isQuestion = contribution['type'] == "Question"
 
-            if 'question' in contribution:
-                if contribution['question'] is not None:
-                    referringTo = contribution['question']['uid']
-            else:
-                referringTo = None
+            referringTo = get_question_uid(contribution)
 
             if 'department' in contribution:
                 department = contribution['department']
@@ -303,124 +493,71 @@ def add_contributions(debates, members, connection):
             else:
                 topic = None
 
-            curr_deb_id = contribution['hansard_file']
+            curr_deb_id = debate_ids.get(contribution['hansard_file'])
+            if curr_deb_id is None:
+                print("No debate {0} for contribution {1}".format(contribution['hansard_file'], contribution['uid']))
+                continue
 
             try:
-                command = '''INSERT INTO contributions(uid, member, debate, body, isQuestion, referringTo, topic, section, contType, sectionTag, department)
-                            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);'''
-                curr_entry = (int(contribution['uid']), int(member_id),
-                                curr_deb_id, contribution['text'], isQuestion, referringTo,
-                                topic, contribution['section'], contribution['contribution_type'],
-                                contribution['section_tag'], department)
-                cursor.execute(command, curr_entry)
-                print(cursor.lastrowid)
-            except SQLError as e:
-                print("Something went wrong adding contribution {}".format(contribution['uid']))
-                print(e)
+                yield (int(contribution['uid']), int(member_id),
+                       curr_deb_id, contribution['text'], isQuestion, referringTo,
+                       topic, contribution['section'], contribution['contribution_type'],
+                       contribution['section_tag'], department)
             except Exception as e:
                 print("Something went wrong adding contribution {}".format(contribution['uid']))
                 print(e)
 
 
+# A contribution that's already in there (same UID) is left as it is.
+sql_insert_contribution = '''INSERT OR IGNORE INTO contributions(uid, member, debate, body, isQuestion, referringTo, topic, section, contType, sectionTag, department)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);'''
+
+
+# The contributions' debates need to be in the debates table already.
+def add_contributions(debates, member_index, connection):
+    rows = get_contribution_rows(debates, get_debate_ids(connection), member_index)
+    n_rows = insert_rows(connection, sql_insert_contribution, rows, "contributions")
+    print("Added {} contributions".format(n_rows))
+
+
 if __name__ == '__main__':
+    # Optionally give a start and end date (YYYY-MM-DD) to only use the debates between them.
+    start = None
+    end = None
     if len(sys.argv) < 2:
         filename = input("Enter DB FP: ")
         json_dir = input("Enter JSON Dir: ")
     else:
         filename = sys.argv[1]
         json_dir = sys.argv[2]
+        if len(sys.argv) > 4:
+            start = sys.argv[3]
+            end = sys.argv[4]
 
     connection = create_connection(filename)
 
-    sql_create_contributions = """
-    CREATE TABLE IF NOT EXISTS contributions (
-        uid integer PRIMARY KEY,
-        member integer NOT NULL,
-        debate integer NOT NULL,
-        body text NOT NULL,
-        isQuestion integer NOT NULL,
-        referringTo integer,
-        topic text,
-        section text,
-        contType text,
-        sectionTag text,
-        department text,
-        FOREIGN KEY (member) REFERENCES members (PimsId)
-        FOREIGN KEY (debate) REFERENCES debates (uid)
-    );"""
-
-    sql_create_debates = """
-    CREATE TABLE IF NOT EXISTS debates (
-        uid text PRIMARY KEY,
-        date text,
-        hansardNum text,
-        file text
-    );"""
-
-    sql_create_members = """
-    CREATE TABLE IF NOT EXISTS members (
-        PimsId integer PRIMARY KEY,
-        MnisId integer,
-        ClerksId integer,
-        name text,
-        curr_party text,
-        curr_constituency text,
-        member_since text,
-        member_until text
-    );"""
-
-    sql_create_member_party = """
-    CREATE TABLE IF NOT EXISTS member_party (
-        PimsId integer NOT NULL,
-        start text NOT NULL,
-        end text,
-        party text NOT NULL,
-        PRIMARY KEY (PimsId, start),
-        FOREIGN KEY (PimsId) REFERENCES members (PimsId)
-    );"""
-
-    sql_create_member_constituency = """
-    CREATE TABLE IF NOT EXISTS member_constituency (
-        PimsId integer NOT NULL,
-        start text NOT NULL,
-        end text,
-        constituency text NOT NULL,
-        PRIMARY KEY (PimsId, start),
-        FOREIGN KEY (PimsId) REFERENCES members (PimsId)
-    );"""
-
     if connection is not None:
-        # Create Debates table
-        create_table(connection, sql_create_debates)
-        print("Created debates table.")
-
-        # Create Members table
-        create_table(connection, sql_create_members)
-        print("Created members table.")
-
-        # Create Contribution table
-        create_table(connection, sql_create_contributions)
-        print("Created contributions table.")
-
-        # Create Contribution table
-        create_table(connection, sql_create_member_party)
-        print("Created contributions table.")
-
-        # Create Contribution table
-        create_table(connection, sql_create_member_constituency)
-        print("Created contributions table.")
+        create_tables(connection)
+        set_load_pragmas(connection)
     else:
         print("Cannot connect to Database.")
 
 
-    all_debates = get_all_debates(json_dir)
-    members = add_members(all_debates, connection)
+    # The manifest from remove_duplicates.py has everything needed for the debates table.
+    sittings = get_manifest_sittings(json_dir, start, end)
+    if sittings is not None:
+        add_debates_from_manifest(sittings, connection)
 
-    all_debates = get_all_debates(json_dir)
-    add_debates(all_debates, connection)
+    # Each debate is only read once: its contributions go in and its members are noted on the way through.
+    all_debates = get_all_debates(json_dir, start, end)
+    all_members, pending = add_debates_and_contributions(all_debates, connection)
 
-    all_debates = get_all_debates(json_dir)
-    add_contributions(all_debates, members, connection)
+    # Then the members are looked up, and the contributions that needed them added.
+    member_index = get_member_index(add_members(all_members, connection))
+    add_contributions([pending], member_index, connection)
 
+    create_indexes(connection)
+    analyze_db(connection)
+    set_normal_pragmas(connection)
     connection.commit()
     connection.close()
@@ -0,0 +1,120 @@
+# Moves a database made before debates had an integer id over to the new layout:
+#   - debates gets an id (integer primary key), with uid (the hansard file name) kept as its own column,
+#   - contributions.debate is changed from the hansard file name to that id.
+# Any other columns (e.g. ones added after make_db.py) and indexes are kept.
+# Run with
+#   python migrate_debate_ids.py DB_PATH [--drop-orphans]
+# It's all done in one transaction, so if anything goes wrong the database is left as it was.
+# A contribution whose debate isn't in the debates table has nothing to point at afterwards, so if there are any
+# it stops before changing anything and lists those debates. With --drop-orphans those contributions are left out instead.
+import re
+import sys
+
+from make_db import create_connection, create_indexes, analyze_db
+
+
+# Gets the name, type and whether it's NOT NULL for each column in a table.
+def get_columns(connection, table):
+    return [(row[1], row[2], row[3]) for row in connection.execute("PRAGMA table_info({});".format(table))]
+
+
+# Gets the CREATE statements for the indexes made on a table (not the ones SQLite makes itself).
+def get_index_sql(connection, table):
+    command = '''SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL;'''
+    return [row[0] for row in connection.execute(command, (table,))]
+
+
+def is_migrated(connection):
+    return "id" in [name for name, type_name, not_null in get_columns(connection, "debates")]
+
+
+# Gets the debates contributions point at that aren't in the debates table, with how many contributions point at each.
+def get_orphan_debates(connection):
+    command = '''SELECT c.debate, COUNT(*) FROM contributions AS c
+                 WHERE NOT EXISTS (SELECT 1 FROM debates AS d WHERE d.uid = c.debate) GROUP BY c.debate ORDER BY c.debate;'''
+    return connection.execute(command).fetchall()
+
+
+def migrate(connection):
+    debate_columns = get_columns(connection, "debates")
+    contribution_columns = [name for name, type_name, not_null in get_columns(connection, "contributions")]
+    contributions_sql = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'contributions';").fetchone()[0]
+    index_sql = get_index_sql(connection, "debates") + get_index_sql(connection, "contributions")
+
+    # The debates, in date order, get their ids.
+    definitions = ["id integer PRIMARY KEY"]
+    for name, type_name, not_null in debate_columns:
+        if name == "uid":
+            definitions.append("uid text NOT NULL UNIQUE")
+        else:
+            definitions.append("{0} {1}{2}".format(name, type_name, " NOT NULL" if not_null else ""))
+    names = ", ".join(name for name, type_name, not_null in debate_columns)
+    connection.execute("CREATE TABLE debates_new ({});".format(", ".join(definitions)))
+    connection.execute("INSERT INTO debates_new({0}) SELECT {0} FROM debates ORDER BY date, uid;".format(names))
+
+    # The contributions table is made again from its own CREATE statement, pointing at the new key.
+    contributions_sql = re.sub(r"CREATE TABLE\s+(IF NOT EXISTS\s+)?[\"']?contributions[\"']?", "CREATE TABLE contributions_new",
+                               contributions_sql, count=1)
+    contributions_sql = re.sub(r"REFERENCES\s+debates\s*\(\s*uid\s*\)", "REFERENCES debates (id)", contributions_sql)
+    connection.execute(contributions_sql)
+
+    # Only contributions with a debate are kept, which is all of them unless it was run with --drop-orphans.
+    selected = ", ".join("d.id" if name == "debate" else "c.{}".format(name) for name in contribution_columns)
+    connection.execute('''INSERT INTO contributions_new({0})
+                       SELECT {1} FROM contributions AS c
+                       INNER JOIN debates_new AS d ON d.uid = c.debate;'''.format(", ".join(contribution_columns), selected))
+
+    connection.execute("DROP TABLE contributions;")
+    connection.execute("DROP TABLE debates;")
+    connection.execute("ALTER TABLE debates_new RENAME TO debates;")
+    connection.execute("ALTER TABLE contributions_new RENAME TO contributions;")
+
+    for command in index_sql:
+        connection.execute(command)
+
+
+if __name__ == "__main__":
+    drop_orphans = "--drop-orphans" in sys.argv
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(args) > 0:
+        db_fp = args[0]
+    else:
+        db_fp = input("Enter DB FP: ")
+
+    connection = create_connection(db_fp)
+    if connection is None:
+        print("Cannot connect to Database.")
+        sys.exit(1)
+
+    if is_migrated(connection):
+        print("{} already has debate ids.".format(db_fp))
+        sys.exit(0)
+
+    orphans = get_orphan_debates(connection)
+    if orphans:
+        n_orphans = sum(n for debate, n in orphans)
+        orphan_list = ", ".join("{0} ({1})".format(debate, n) for debate, n in orphans)
+        if not drop_orphans:
+            print("{0} contributions are for debates that aren't in the debates table: {1}".format(n_orphans, orphan_list))
+            print("Nothing has been changed. Add them to the debates table, or run again with --drop-orphans to leave them out.")
+            sys.exit(1)
+        print("Leaving out {0} contributions for debates that aren't in the debates table: {1}".format(n_orphans, orphan_list))
+
+    # Do it all ourselves in one transaction, tables and all.
+    connection.isolation_level = None
+    connection.execute("PRAGMA foreign_keys = OFF;")
+    connection.execute("BEGIN;")
+    try:
+        migrate(connection)
+        connection.execute("COMMIT;")
+    except Exception:
+        connection.execute("ROLLBACK;")
+        raise
+    print("Gave {} debates ids.".format(connection.execute("SELECT COUNT(*) FROM debates;").fetchone()[0]))
+
+    # The indexes from make_db.py, if they weren't there already, then give back the space the old tables took up.
+    connection.isolation_level = ""
+    create_indexes(connection)
+    analyze_db(connection)
+    connection.execute("VACUUM;")
+    connection.close()
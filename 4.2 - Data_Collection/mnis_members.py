@@ -0,0 +1,149 @@
+# The members data platform (MNIS) records for every member of the Commons, with their parties and constituencies.
+# The all-members document is downloaded once (through http_cache.py) and parsed into a record for each member,
+# and the records are kept in a json file so the next build can read them straight back in.
+# Members are then looked up from memory by their PimsId, MnisId or ClerksId.
+# Run with
+#   python mnis_members.py [--refresh]
+# to build the json (--refresh gets the document again even if what we have is fresh).
+import os
+import sys
+import json
+import time
+import hashlib
+from io import BytesIO
+from lxml import etree
+from http_cache import fetch, write_atomic, CACHE_DIR, TTL, OFFLINE
+
+
+MEMBERS_URL = "http://data.parliament.uk/membersdataplatform/services/mnis/members/query/House=Commons|Membership=all/Parties|Constituencies"
+MEMBERS_FP = os.environ.get("HANSARD_MEMBERS_FP", os.path.join(CACHE_DIR, "mnis_members.json"))
+# Change this if what's kept for each member changes, so the json is made again.
+RECORD_VERSION = 1
+
+
+def get_text(element, path):
+    found = element.find(path)
+    return None if found is None else found.text
+
+
+# Gets the start, end and name of each Party or Constituency in a list of them.
+def get_periods(parent, tag):
+    periods = []
+    if parent is None:
+        return periods
+    for period in parent.iterfind(tag):
+        periods.append({"start": get_text(period, "{*}StartDate"),
+                        "end": get_text(period, "{*}EndDate"),
+                        "name": get_text(period, "{*}Name")})
+    return periods
+
+
+# Gets everything we keep about a member from their Member element.
+def parse_member(member):
+    return {"PimsId": member.attrib.get('Pims_Id', ""),
+            "ClerksId": member.attrib.get('Clerks_Id', ""),
+            "MnisId": member.attrib.get('Member_Id', ""),
+            "name": get_text(member, "{*}DisplayAs"),
+            "curr_party": get_text(member, "{*}Party"),
+            "curr_constituency": get_text(member, "{*}MemberFrom"),
+            "member_since": get_text(member, "{*}HouseStartDate"),
+            "member_until": get_text(member, "{*}HouseEndDate"),
+            "parties": get_periods(member.find("{*}Parties"), "{*}Party"),
+            "constituencies": get_periods(member.find("{*}Constituencies"), "{*}Constituency")}
+
+
+# Parses the all-members document a member at a time, in the order they're in the document.
+def parse_members(data):
+    records = []
+    for event, member in etree.iterparse(BytesIO(data), tag="{*}Member"):
+        records.append(parse_member(member))
+        # Done with this member, so free it (and anything before it).
+        member.clear()
+        while member.getprevious() is not None:
+            del member.getparent()[0]
+    return records
+
+
+def read_records(fp):
+    if not os.path.isfile(fp):
+        return None
+    with open(fp) as records_file:
+        return json.load(records_file)
+
+
+def write_records(fp, saved):
+    if not os.path.isdir(os.path.dirname(fp)):
+        os.makedirs(os.path.dirname(fp))
+    write_atomic(fp, json.dumps(saved), mode="w")
+
+
+# Gets the record for every member.
+# The saved json is used while it's fresh (see HANSARD_CACHE_TTL). After that the document is checked with the server
+# (only downloaded if it's changed) and only parsed again if its bytes are different to what the json was made from.
+def load_members(fp=None, refresh=False):
+    fp = MEMBERS_FP if fp is None else fp
+
+    saved = read_records(fp)
+    if saved is not None and saved['version'] != RECORD_VERSION:
+        saved = None
+    if saved is not None and not refresh and (OFFLINE or time.time() - saved['built_at'] < TTL):
+        return saved['members']
+
+    data = fetch(MEMBERS_URL, ttl=0 if refresh else None)
+    digest = hashlib.sha256(data).hexdigest()
+    if saved is None or saved['hash'] != digest:
+        saved = {"version": RECORD_VERSION, "hash": digest, "members": parse_members(data)}
+        print("Parsed {} members from MNIS".format(len(saved['members'])))
+    saved['built_at'] = time.time()
+    write_records(fp, saved)
+
+    return saved['members']
+
+
+# Indexes the members by each of their ids, so a member can be found from whichever id we have for them.
+# The ids are kept as strings, as they are in the json (the database has them as integers).
+# If two members share an id, the first one is kept.
+def get_member_index(members):
+    member_index = {"PimsId": dict(), "MnisId": dict(), "ClerksId": dict()}
+    for member in members:
+        add_to_member_index(member_index, member)
+    return member_index
+
+
+def add_to_member_index(member_index, member):
+    for id_name, ids in member_index.items():
+        if member[id_name] is not None and member[id_name] != "":
+            ids.setdefault(str(member[id_name]), member)
+
+
+# Finds a member in the index, by their MNIS id if we have it and otherwise their Clerks id.
+# Returns None if they aren't in there.
+def find_member(member_index, mnis_id, clerks_id):
+    member = None
+    if mnis_id is not None and mnis_id != "":
+        member = member_index['MnisId'].get(str(mnis_id))
+    if member is None and clerks_id is not None and clerks_id != "":
+        member = member_index['ClerksId'].get(str(clerks_id))
+    return member
+
+
+# Gets the information for a member as found in the debates (pims, mnis and xid, as from make_db.get_all_members).
+# They're looked for by MNIS id, then PimsId, then Clerks id. Returns None if they can't be found.
+def get_member_info(member_index, member):
+    record = find_member(member_index, member['mnis'], None)
+    if record is None and member['pims'] is not None and member['pims'] != "":
+        record = member_index['PimsId'].get(str(member['pims']))
+    if record is None:
+        record = find_member(member_index, None, member['xid'])
+    if record is None:
+        return None
+
+    # Sometimes the PimsId from MNIS is not real, so use the one from the debates.
+    if record['PimsId'] == "":
+        return dict(record, PimsId=member['pims'])
+    return record
+
+
+if __name__ == "__main__":
+    members = load_members(refresh="--refresh" in sys.argv)
+    print("{0} members in {1}".format(len(members), MEMBERS_FP))
@@ -0,0 +1,86 @@
+# A content-addressed store for the raw xml and the processed json.
+# Each file is kept once, under objects/<first two characters of its hash>/<hash>.
+# The directories the pipeline uses (Dump, Tidy, Processed, Final) are then made of links to these objects,
+# so "copying" a file from one stage to the next only touches metadata.
+import os
+import stat
+import shutil
+import hashlib
+import tempfile
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_object_fp(store_dir, digest):
+    return os.path.join(store_dir, "objects", digest[:2], digest)
+
+
+# Writes a stream into the store under the given hash, unless it's already there.
+# Objects are made read-only so nothing can change them through one of their links.
+def add_stream(store_dir, digest, stream):
+    object_fp = get_object_fp(store_dir, digest)
+    if os.path.isfile(object_fp):
+        return object_fp
+
+    object_dir = os.path.dirname(object_fp)
+    os.makedirs(object_dir, exist_ok=True)
+    fd, tmp_fp = tempfile.mkstemp(dir=object_dir)
+    with os.fdopen(fd, "wb") as tmp_file:
+        shutil.copyfileobj(stream, tmp_file, CHUNK_SIZE)
+    os.chmod(tmp_fp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp_fp, object_fp)
+
+    return object_fp
+
+
+# Adds some bytes to the store and gives back where they are.
+def add_bytes(store_dir, data):
+    digest = hashlib.sha256(data).hexdigest()
+    object_fp = get_object_fp(store_dir, digest)
+    if os.path.isfile(object_fp):
+        return object_fp
+
+    object_dir = os.path.dirname(object_fp)
+    os.makedirs(object_dir, exist_ok=True)
+    fd, tmp_fp = tempfile.mkstemp(dir=object_dir)
+    with os.fdopen(fd, "wb") as tmp_file:
+        tmp_file.write(data)
+    os.chmod(tmp_fp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp_fp, object_fp)
+
+    return object_fp
+
+
+# Makes dst_fp point at the same file as src_fp.
+# Tries a hard link first, then a symbolic link (e.g. across drives), and copies it if all else fails.
+def link_file(src_fp, dst_fp):
+    # Never write through an old link, always replace it.
+    if os.path.lexists(dst_fp):
+        os.remove(dst_fp)
+
+    try:
+        os.link(src_fp, dst_fp)
+        return "hardlink"
+    except OSError:
+        pass
+
+    try:
+        os.symlink(os.path.realpath(src_fp), dst_fp)
+        return "symlink"
+    except OSError:
+        pass
+
+    shutil.copyfile(src_fp, dst_fp)
+    return "copy"
+
+
+# Writes data to a file by replacing it rather than writing into it.
+# If the old file was a link into the store, the stored object is left alone.
+def write_replace(data, out_fp):
+    out_dir = os.path.dirname(os.path.abspath(out_fp))
+    fd, tmp_fp = tempfile.mkstemp(dir=out_dir)
+    with os.fdopen(fd, "wb") as tmp_file:
+        tmp_file.write(data)
+    os.chmod(tmp_fp, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp_fp, out_fp)
@@ -1,6 +1,4 @@
 $ZIP_DIR = '*INSERT_DIRECTORY*/Zips'
-$DUMP_DIR = '*INSERT_DIRECTORY*/Dump'
-$TIDY_DIR = '*INSERT_DIRECTORY*/Tidy'
 $TEMP_DIR = '*INSERT_DIRECTORY*/Processed'
 $JSON_DIR = '*INSERT_DIRECTORY*/Final'
 
@@ -12,18 +10,9 @@ $END = '2019-12-12'
 echo 'Beginning extraction.'
 
 echo $ZIP_DIR
-echo $DUMP_DIR
-echo $TIDY_DIR
 
-python filter_files.py "$ZIP_DIR" "$DUMP_DIR"
-
-echo 'All files extracted.'
-
-python tidy_files.py "$DUMP_DIR" "$TIDY_DIR"
-
-echo 'All files tidied.'
-
-python process_xml.py "$TIDY_DIR" "$TEMP_DIR"
+# process_xml.py reads the xml straight out of the zips, so there's no need to extract and tidy them first.
+python process_xml.py "$ZIP_DIR" "$TEMP_DIR"
 
 echo 'All files processed'
 
@@ -31,10 +20,8 @@ python remove_duplicates.py "$TEMP_DIR" "$JSON_DIR"
 
 echo 'All Duplicates Removed'
 
-python delete_outdated.py "$JSON_DIR" "$START" "$END"
-
-echo 'Deleted files out of time range'
-
-python make_db.py "$DB_PATH", "$JSON_DIR"
+# The debates are kept by year and month, so make_db.py only reads the ones in the time range.
+# Nothing is deleted, so the range can be changed without running everything again.
+python make_db.py "$DB_PATH" "$JSON_DIR" "$START" "$END"
 
 echo 'Created database.'
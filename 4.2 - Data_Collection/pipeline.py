@@ -0,0 +1,293 @@
+# Runs the whole pipeline from the zips to the database, like parse_zips.sh, but:
+#   - each stage declares what it reads and writes, and the order comes from that,
+#   - a stage is skipped if its inputs (and its script, and the modules it imports from here) haven't changed since it last ran,
+#   - stages that don't depend on each other run at the same time,
+#   - a report of how long each stage took is printed at the end.
+# Run with
+#   python pipeline.py ROOT_DIR [--start=YYYY-MM-DD] [--end=YYYY-MM-DD] [--workers=N] [--extract] [--force]
+# ROOT_DIR should have a Zips directory in it (from download_zips.py). The other directories are made next to it.
+# Use --extract to also write out the raw and tidied xml (Dump and Tidy) for looking at.
+# Give both --start and --end, or neither.
+# Use --force to run every stage even if nothing has changed.
+# The members data from MNIS is checked every time (see mnis_members.py), and the database is made again if it's changed.
+import os
+import sys
+import ast
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from mnis_members import MEMBERS_FP
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_NAME = "pipeline_state.json"
+
+
+class Stage:
+    # script is the python file to run, and args what to run it with.
+    # If clean is True the outputs are deleted before running, as the script can't run on top of an old copy.
+    # If always is True it's never skipped, as what it depends on is outside the pipeline (e.g. the members data).
+    # The stages after it still only run again if it changed what it writes.
+    def __init__(self, name, script, args, inputs, outputs, clean=False, always=False):
+        self.name = name
+        self.script = script
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+        self.clean = clean
+        self.always = always
+
+
+# Gets the stages for the given directories.
+# make_db.py takes both a start and an end date or neither, so giving just one is an error.
+def get_stages(root_dir, start=None, end=None, n_workers=1, extract=False):
+    if (start is None) != (end is None):
+        raise ValueError("Give both a start and an end date, or neither")
+
+    zip_dir = os.path.join(root_dir, "Zips")
+    processed_dir = os.path.join(root_dir, "Processed")
+    final_dir = os.path.join(root_dir, "Final")
+    db_path = os.path.join(root_dir, "commons.db")
+
+    stages = [Stage("process_xml", "process_xml.py", [zip_dir, processed_dir, "--workers={}".format(n_workers)],
+                    [zip_dir], [processed_dir]),
+              Stage("remove_duplicates", "remove_duplicates.py", [processed_dir, final_dir],
+                    [processed_dir], [final_dir], clean=True),
+              # The members data is refreshed once it's older than HANSARD_CACHE_TTL, and the database made again if it changed.
+              Stage("mnis_members", "mnis_members.py", [], [], [MEMBERS_FP], always=True),
+              Stage("make_db", "make_db.py", [db_path, final_dir] + ([start, end] if start is not None else []),
+                    [final_dir, MEMBERS_FP], [db_path], clean=True)]
+
+    # Extracting the xml isn't needed for the database (process_xml.py reads the zips) so it can run alongside.
+    if extract:
+        dump_dir = os.path.join(root_dir, "Dump")
+        tidy_dir = os.path.join(root_dir, "Tidy")
+        stages += [Stage("filter_files", "filter_files.py", [zip_dir, dump_dir, "--workers={}".format(n_workers)],
+                         [zip_dir], [dump_dir]),
+                   Stage("tidy_files", "tidy_files.py", [dump_dir, tidy_dir],
+                         [dump_dir], [tidy_dir], clean=True)]
+
+    return stages
+
+
+# Gets the stages each stage has to wait for: the ones that write something it reads.
+def get_dependencies(stages):
+    writers = dict()
+    for stage in stages:
+        for output in stage.outputs:
+            writers[os.path.abspath(output)] = stage.name
+
+    dependencies = dict()
+    for stage in stages:
+        dependencies[stage.name] = set(writers[os.path.abspath(i)] for i in stage.inputs if os.path.abspath(i) in writers)
+    return dependencies
+
+
+# Gets the total size of a file, or of everything in a directory.
+def get_size(fp):
+    if os.path.isfile(fp):
+        return os.path.getsize(fp)
+
+    total = 0
+    for subdir, dirs, files in os.walk(fp):
+        for filename in files:
+            total += os.path.getsize(os.path.join(subdir, filename))
+    return total
+
+
+# Gets the modules in this directory a script imports, directly or through another of them, along with the script.
+def get_local_modules(script):
+    modules = set()
+    to_visit = [script]
+    while to_visit:
+        curr_script = to_visit.pop()
+        if curr_script in modules:
+            continue
+        modules.add(curr_script)
+
+        with open(os.path.join(SCRIPT_DIR, curr_script), "rb") as script_file:
+            tree = ast.parse(script_file.read(), curr_script)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_fp = "{}.py".format(name.split(".")[0])
+                if os.path.isfile(os.path.join(SCRIPT_DIR, module_fp)):
+                    to_visit.append(module_fp)
+
+    return sorted(modules)
+
+
+# Gets a fingerprint of everything a stage depends on: the name, size and modification time of each input file,
+# along with the script, the modules it imports from here and what it's run with.
+# If the fingerprint is the same as last time, so is the output.
+def get_fingerprint(stage):
+    digest = hashlib.sha256()
+    for module_fp in get_local_modules(stage.script):
+        with open(os.path.join(SCRIPT_DIR, module_fp), "rb") as module_file:
+            digest.update("{}\n".format(module_fp).encode("utf-8"))
+            digest.update(module_file.read())
+    digest.update(json.dumps(stage.args).encode("utf-8"))
+
+    for input_fp in stage.inputs:
+        if os.path.isfile(input_fp):
+            stat = os.stat(input_fp)
+            digest.update("{0}\t{1}\t{2}\n".format(input_fp, stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+            continue
+
+        for subdir, dirs, files in os.walk(input_fp):
+            dirs.sort()
+            for filename in sorted(files):
+                curr_fp = os.path.join(subdir, filename)
+                stat = os.stat(curr_fp)
+                digest.update("{0}\t{1}\t{2}\n".format(os.path.relpath(curr_fp, input_fp), stat.st_size,
+                                                       stat.st_mtime_ns).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def read_state(state_fp):
+    if not os.path.isfile(state_fp):
+        return dict()
+    with open(state_fp) as state_file:
+        return json.load(state_file)
+
+
+def write_state(state_fp, state):
+    tmp_fp = "{}.tmp".format(state_fp)
+    with open(tmp_fp, "w") as tmp_file:
+        json.dump(state, tmp_file, indent=2)
+    os.replace(tmp_fp, state_fp)
+
+
+def remove_output(fp):
+    if os.path.isdir(fp):
+        shutil.rmtree(fp)
+    elif os.path.lexists(fp):
+        os.remove(fp)
+
+
+# Runs a single stage, with what it prints going to a log file.
+# Returns a summary of how it went.
+def run_stage(stage, log_dir, fingerprint):
+    summary = {"stage": stage.name, "status": "ran", "seconds": 0.0, "bytes": 0, "fingerprint": fingerprint}
+    summary['bytes'] = sum(get_size(i) for i in stage.inputs if os.path.exists(i))
+
+    if stage.clean:
+        for output in stage.outputs:
+            remove_output(output)
+
+    start_time = time.perf_counter()
+    with open(os.path.join(log_dir, "{}.log".format(stage.name)), "w") as log_file:
+        # Run it in the log directory, so anything else it writes (e.g. section_file.json) ends up there too.
+        result = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, stage.script)] + stage.args, cwd=log_dir,
+                                stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+    summary['seconds'] = time.perf_counter() - start_time
+
+    if result.returncode != 0:
+        summary['status'] = "failed"
+    return summary
+
+
+# Runs the stages in order of their dependencies, any that are ready at the same time running together.
+# A stage is skipped if its fingerprint hasn't changed and its outputs are still there.
+def run_pipeline(stages, state_fp, log_dir, force=False, n_parallel=None):
+    dependencies = get_dependencies(stages)
+    state = read_state(state_fp)
+    os.makedirs(log_dir, exist_ok=True)
+
+    summaries = dict()
+    waiting = {stage.name: stage for stage in stages}
+    running = dict()
+
+    with ThreadPoolExecutor(max_workers=n_parallel or len(stages)) as pool:
+        while waiting or running:
+            # Start everything whose dependencies have finished.
+            for name, stage in list(waiting.items()):
+                if not dependencies[name] <= set(summaries):
+                    continue
+                del waiting[name]
+
+                # If something it needs failed, it can't run.
+                if any(summaries[d]['status'] in ("failed", "not run") for d in dependencies[name]):
+                    summaries[name] = {"stage": name, "status": "not run", "seconds": 0.0, "bytes": 0}
+                    continue
+
+                # If something it needs was run again, its inputs will have changed, which the fingerprint will see.
+                fingerprint = get_fingerprint(stage)
+                if not force and not stage.always and state.get(name) == fingerprint and all(os.path.exists(o) for o in stage.outputs):
+                    summaries[name] = {"stage": name, "status": "skipped", "seconds": 0.0, "bytes": 0}
+                    print("Skipping {}, nothing has changed".format(name))
+                    continue
+
+                print("Running {}".format(name))
+                running[pool.submit(run_stage, stage, log_dir, fingerprint)] = name
+
+            if not running:
+                # Nothing to wait for, so anything still waiting depends on itself somewhere.
+                if waiting and not any(dependencies[name] <= set(summaries) for name in waiting):
+                    raise ValueError("The stages {} depend on each other".format(", ".join(waiting)))
+                continue
+
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                summaries[name] = future.result()
+                print("Finished {0} ({1})".format(name, summaries[name]['status']))
+                if summaries[name]['status'] == "ran":
+                    state[name] = summaries[name]['fingerprint']
+                else:
+                    state.pop(name, None)
+                write_state(state_fp, state)
+
+    return [summaries[stage.name] for stage in stages]
+
+
+def print_report(summaries):
+    print("\n{0:<20} {1:>8} {2:>10} {3:>12} {4:>10}".format("Stage", "Status", "Seconds", "Input (MB)", "MB/s"))
+    for summary in summaries:
+        mb = summary['bytes'] / (1024 * 1024)
+        rate = mb / summary['seconds'] if summary['seconds'] > 0 else 0.0
+        print("{0:<20} {1:>8} {2:>10.2f} {3:>12.1f} {4:>10.2f}".format(summary['stage'], summary['status'],
+                                                                     summary['seconds'], mb, rate))
+    print("{0:<20} {1:>8} {2:>10.2f}".format("Total", "", sum(s['seconds'] for s in summaries)))
+
+
+if __name__ == "__main__":
+    force = "--force" in sys.argv
+    extract = "--extract" in sys.argv
+    start = None
+    end = None
+    n_workers = 1
+    for arg in sys.argv[1:]:
+        if arg.startswith("--start="):
+            start = arg.split("=", 1)[1]
+        elif arg.startswith("--end="):
+            end = arg.split("=", 1)[1]
+        elif arg.startswith("--workers="):
+            n_workers = int(arg.split("=")[1])
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if (start is None) != (end is None):
+        print("Give both --start and --end, or neither.")
+        sys.exit(1)
+
+    if len(args) > 0:
+        root_dir = args[0]
+    else:
+        root_dir = input("Enter the directory with the Zips directory in it:\n")
+    root_dir = os.path.abspath(root_dir)
+
+    stages = get_stages(root_dir, start, end, n_workers, extract)
+    summaries = run_pipeline(stages, os.path.join(root_dir, STATE_NAME), os.path.join(root_dir, "logs"), force)
+    print_report(summaries)
+
+    if any(s['status'] in ("failed", "not run") for s in summaries):
+        sys.exit(1)
@@ -2,8 +2,23 @@ import os
 import sys
 import re
 import json
+import hashlib
+import zipfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree
 
+from filter_files import iter_xmls
+from content_index import get_index_dir, spool_and_hash, claim, settle_claims
+from object_store import add_bytes, link_file, write_replace
+from debate_io import FORMATS, dump_debate
+from processing_manifest import get_manifest_fp, open_manifest, hash_file, get_input, is_current, is_unmodified
+from processing_manifest import record_input, record_unmodified, get_all_sections, delete_output
+
+
+# Bump this whenever a change to the parsing changes the json, so everything gets processed again.
+PARSER_VERSION = 1
+
 
 # Process a member.
 def process_member(member):
@@ -43,17 +58,19 @@ def get_all_text(curr_element):
 
     # If the element has children. Check their tails for text.
     if len(curr_element):
-        chillens = list(curr_element)
-        for child in chillens:
+        # Collect the bits and join them once, rather than building the string up a bit at a time.
+        parts = [text]
+        for child in curr_element:
             if child.tail is not None:
-                child_tag = child.tag
                 new_text = child.tail
                 new_text = new_text.replace("\n", " ").strip()
-                text = "{0} {1}".format(text, new_text)
+                parts.append(new_text)
 
             # if re.fullmatch(r"\{.*\}I", str(child.tag)):
             #     print("Found another fucker")
 
+        text = " ".join(parts)
+
     return text
 
 
@@ -147,231 +164,662 @@ def add_para(para, debate):
                 if para['uid'] not in debate:
                     debate[para['uid']] = para
 
-def reset_vars(variables):
-    for var in variables:
-        var = None
+# Joins any text waiting to go on the end of the current paragraph, then adds it to the debate.
+# Continuations are kept in a list until now so long speeches aren't copied every time a bit is added.
+def flush_para(state, debate):
+    if state['para'] is not None and state['text_parts']:
+        state['para']['text'] = " ".join([state['para']['text']] + state['text_parts'])
+    state['text_parts'] = []
+    add_para(state['para'], debate)
+
+# Gets a fresh set of "current" variables for the start of a sitting.
+# If given a list, problems are added to it rather than printed.
+def new_state(filename, errors=None):
+    # At the beginning of the debates, set topic to none.
+    return {"topic": None,
+            "speaker": None,
+            "question": None,
+            "para": None,
+            "text_parts": [],
+            "section": None,
+            "department": None,
+            "section_tag": None,
+            "date": None,
+            "xml_file": filename.split(".")[0],
+            "filename": filename,
+            "members": dict(),
+            "errors": errors}
+
+
+# Gives back the one copy of this member's dict for the sitting, so every contribution by them shares it.
+def intern_member(state, member):
+    if member is None:
+        return None
+    key = (member['member_name'], member['member_id'], member['member_mnis'], member['member_xid'])
+    return state['members'].setdefault(key, member)
+
+
+# Gets the UID of a question, so answers can refer to it without carrying a copy of it.
+def get_question_uid(question):
+    return None if question is None else question['uid']
+
+
+# Forget everything we know about the current section.
+def reset_section(state, section_tag):
+    # Set everything to be None
+    state['para'] = None
+    state['text_parts'] = []
+    state['topic'] = None
+    state['speaker'] = None
+    state['department'] = None
+    state['question'] = None
+    # Update the current section tag
+    state['section_tag'] = section_tag
+
+
+# Check if it is a Section marker
+def handle_section(child, curr_tag, state, hansard_debate, all_sections):
+    curr_section = etree.tostring(child, method="text", encoding="unicode")
+    state['section'] = curr_section.replace("\n", " ").strip()
+    all_sections.add((state['section'], curr_tag))
+    flush_para(state, hansard_debate)
+    reset_section(state, curr_tag)
+
+
+# Check if it's an Oral Answers marker (for some reason separate)
+def handle_oral_answers(child, curr_tag, state, hansard_debate, all_sections):
+    if child.text is not None:
+        state['section'] = child.text.replace("\n", " ").strip()
+        all_sections.add((state['section'], curr_tag))
+        flush_para(state, hansard_debate)
+        reset_section(state, curr_tag)
+
+
+# Check if it's a Department tag.
+def handle_department(child, curr_tag, state, hansard_debate, all_sections):
+    department = child.find(".//{*}DepartmentName")
+    if department is not None and department.text is not None:
+        state['department'] = department.text.replace("\n", " ").strip()
+
+
+# Check if it is a question topic.
+def handle_topic(child, curr_tag, state, hansard_debate, all_sections):
+    if child.text is not None:
+        state['topic'] = child.text.replace("\n", " ").strip()
+
+
+# Check if it is a question.
+def handle_question(child, curr_tag, state, hansard_debate, all_sections):
+    # Ignore certain sections.
+    if state['section_tag'] == "hs_2BusinessWODebate":
+        return
+
+    # Questions contain a normal para element.
+    question = process_question(child)
+    question['member'] = intern_member(state, question['member'])
+
+    # Set the current speaker in case next paragraph doesn't specify.
+    state['speaker'] = question['member']
+
+    # Set the topic, department and section.
+    question['topic'] = state['topic']
+    question['department'] = state['department']
+    question['section'] = state['section']
+    question['section_tag'] = state['section_tag']
+
+    # Set the time
+    question['date'] = state['date']
+
+    # Set the file it's from.
+    question['hansard_file'] = state['xml_file']
+
+    # Set the current question.
+    state['question'] = question
+
+    # Add the current paragraph first to maintain order.
+    flush_para(state, hansard_debate)
+    state['para'] = None
+
+    # Add question to debate list
+    add_para(question, hansard_debate)
+
+
+# Check if it is just a paragraph of speech.
+def handle_para(child, curr_tag, state, hansard_debate, all_sections):
+    # Ignore certain sections.
+    if state['section_tag'] == "hs_2BusinessWODebate":
+        return
+
+    # Get the paragraph deets.
+    para = process_para(child)
+    para['member'] = intern_member(state, para['member'])
+
+    # Only set the question if it is the answers section.
+    # Just its UID is kept, the question itself is its own contribution.
+    if state['section_tag'] == "hs_3OralAnswers":
+        para['question'] = get_question_uid(state['question'])
+
+    # Set the date and the section.
+    para['date'] = state['date']
+    para['section'] = state['section']
+    para['section_tag'] = state['section_tag']
+    # Set the file it's from.
+    para['hansard_file'] = state['xml_file']
+
+    # Set the current speaker in case next paragraph doesn't specify.
+    if para['member'] is not None:
+        # Add the previous paragraph to the list.
+        flush_para(state, hansard_debate)
+        # Update the current paragraph.
+        state['para'] = para
+        state['speaker'] = para['member']
+    else:
+        # If speaker wasn't recorded, it is the previous speaker.
+        para['member'] = state['speaker']
+        # If this is just a continuation, add the text to the previous para.
+        if state['para'] is not None:
+            state['text_parts'].append(para['text'])
+
+
+# Check if it is a quote.
+def handle_quote(child, curr_tag, state, hansard_debate, all_sections):
+    quote_text = child.text
+    if state['para'] is not None and quote_text is not None:
+        quote_text = quote_text.replace("\n", " ").strip()
+        if re.match(r'[\“\'\"].+[\”\'\"]', quote_text):
+            state['text_parts'].append(quote_text)
+
+
+# Tags without a namespace can't be processed.
+def handle_bad_tag(child, curr_tag, state, hansard_debate, all_sections):
+    report_problem(state, child.tag)
+
+
+# Either prints a problem or adds it to the list of errors as (file name, tag, message).
+def report_problem(state, tag, error=None):
+    if state['errors'] is not None:
+        state['errors'].append((state['filename'], str(tag), None if error is None else str(error)))
+    else:
+        print("Problems processing {}".format(tag))
+        if error is not None:
+            print(error)
+
+
+# Which handler to use for each type of element, checked in this order.
+HANDLER_PATTERNS = [(re.compile(r"hs_2\w+"), handle_section),
+                    (re.compile(r"hs_3OralAnswers"), handle_oral_answers),
+                    (re.compile(r"hs_6bDepartment"), handle_department),
+                    (re.compile(r"hs_8\w+"), handle_topic),
+                    (re.compile(r"Question"), handle_question),
+                    (re.compile(r"hs_Para"), handle_para),
+                    (re.compile(r"hs_brev"), handle_quote)]
+
+# Table from namespace-qualified tag to its handler and tag name.
+# The regexes are only run the first time we see each tag, after that it's a dictionary lookup.
+tag_handlers = dict()
+
+
+def get_handler(qualified_tag):
+    if qualified_tag not in tag_handlers:
+        # remove the gubbins from in front of the actual tag
+        m = re.match(r"\{.*\}(\w+)", qualified_tag)
+        if m is None:
+            tag_handlers[qualified_tag] = (handle_bad_tag, None)
+        else:
+            curr_tag = m.group(1)
+            handler = None
+            for pattern, pattern_handler in HANDLER_PATTERNS:
+                if pattern.fullmatch(curr_tag):
+                    handler = pattern_handler
+                    break
+            tag_handlers[qualified_tag] = (handler, curr_tag)
+
+    return tag_handlers[qualified_tag]
+
+
+# Processes one element in the body of a fragment.
+def handle_child(child, state, hansard_debate, all_sections):
+    try:
+        # Skip this child if the tag is not a string.
+        if not isinstance(child.tag, str):
+            return
+
+        # Check which type of element it is and process accordingly.
+        handler, curr_tag = get_handler(child.tag)
+        if handler is not None:
+            handler(child, curr_tag, state, hansard_debate, all_sections)
+    except Exception as e:
+        report_problem(state, child.tag, e)
+
+
+# Gets the tag without its namespace.
+def local_name(tag):
+    return tag.rpartition("}")[2]
+
+
+# Processes a single sitting into a dictionary of contributions keyed by UID, by loading the whole tree.
+# The source can be a file path or an open file, and filename is the tidy-style name (<id>-CHANxxxx.xml).
+# Any sections found are added to all_sections, and problems to errors (if given).
+def process_debate_tree(source, filename, all_sections, errors=None):
+    # create element tree object
+    tree = etree.parse(source)
+
+    # get root element
+    root = tree.getroot()
+
+    # Get the tag containing the commons stuff.
+    debates = root.find(".//{*}System[@type='Debate']")
+
+    state = new_state(filename, errors)
+
+    # Initialise the list of paras for the debate.
+    hansard_debate = dict()
+
+    # Loop through each fragment and extract the debate info.
+    for fragment in debates.iterfind("{*}Fragment"):
+        # Extract the header and find the date of the sitting.
+        header = fragment.find("{*}Header")
+        state['date'] = header.find("{*}Sitting").attrib['short-date']
+
+        # Now process the body to get further goodies.
+        body = fragment.find("{*}Body")
+        for child in body:
+            handle_child(child, state, hansard_debate, all_sections)
+
+        flush_para(state, hansard_debate)
+
+    return hansard_debate
+
+
+# Processes a single sitting into a dictionary of contributions keyed by UID, streaming it with iterparse.
+# Gives the same result as process_debate_tree, but each element of a body is cleared once it's been handled,
+# so the memory used doesn't grow with the size of the sitting.
+def process_debate_stream(source, filename, all_sections, errors=None):
+    state = new_state(filename, errors)
+    hansard_debate = dict()
+
+    # How deep we are, and how deep the debate System is (None until we find it).
+    # Below the System are its Fragments, then each Fragment's Header and Body, then the Sitting and body elements.
+    depth = 0
+    system_depth = None
+    in_fragment = False
+    in_header = False
+    in_body = False
+    # Only the first Header and Body of each fragment are used.
+    seen_header = False
+    seen_body = False
+    # Body elements are handled when the next one starts (or the body ends), so that their tails have been read.
+    pending = None
+
+    for event, elem in etree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if system_depth is None:
+                # The debate System can be anywhere below the root.
+                if depth > 1 and local_name(elem.tag) == "System" and elem.get("type") == "Debate":
+                    system_depth = depth
+            elif depth == system_depth + 1:
+                in_fragment = local_name(elem.tag) == "Fragment"
+                seen_header = False
+                seen_body = False
+            elif depth == system_depth + 2 and in_fragment:
+                name = local_name(elem.tag)
+                in_header = name == "Header" and not seen_header
+                in_body = name == "Body" and not seen_body
+                seen_header = seen_header or in_header
+                seen_body = seen_body or in_body
+            elif depth == system_depth + 3 and in_body and pending is not None:
+                handle_child(pending, state, hansard_debate, all_sections)
+                clear_element(pending)
+                pending = None
+            continue
+
+        elem_depth = depth
+        depth -= 1
+
+        if system_depth is None:
+            # Nothing outside the debate is needed.
+            if elem_depth == 2:
+                clear_element(elem)
+        elif elem_depth == system_depth + 3:
+            if in_body:
+                pending = elem
+            elif in_header and local_name(elem.tag) == "Sitting":
+                # Extract the header and find the date of the sitting.
+                state['date'] = elem.attrib['short-date']
+                in_header = False
+        elif elem_depth == system_depth + 2:
+            if in_body and pending is not None:
+                handle_child(pending, state, hansard_debate, all_sections)
+                pending = None
+            in_header = False
+            in_body = False
+        elif elem_depth == system_depth + 1:
+            if in_fragment:
+                flush_para(state, hansard_debate)
+            in_fragment = False
+            clear_element(elem)
+        elif elem_depth == system_depth:
+            # The end of the debate, so we're done.
+            break
+
+    return hansard_debate
+
+
+# Clears an element along with anything before it, so the tree doesn't build up in memory.
+def clear_element(elem):
+    parent = elem.getparent()
+    while elem.getprevious() is not None:
+        del parent[0]
+    elem.clear()
+
+
+# Processes a single sitting into a dictionary of contributions keyed by UID.
+def process_debate(source, filename, all_sections, streaming=True, errors=None):
+    if streaming:
+        return process_debate_stream(source, filename, all_sections, errors)
+    else:
+        return process_debate_tree(source, filename, all_sections, errors)
+
+
+# Gets rid of the json for a sitting, in whatever format it was written (apart from the one to keep).
+def remove_debate(outdir, filename, keep_format=None):
+    for old_format, ext in FORMATS.items():
+        if old_format == keep_format:
+            continue
+        old_fp = "{0}/{1}{2}".format(outdir, filename, ext)
+        if os.path.lexists(old_fp):
+            os.remove(old_fp)
+
+
+# Writes a debate to a json file in the output directory.
+# The format can be "json" (one object keyed by UID) or "ndjson" (one contribution per line).
+# If given a store directory, the json is kept in the object store and linked into the output directory.
+# Returns the name of the file written and the hash of what was written to it.
+def write_debate(hansard_debate, outdir, filename, store_dir=None, out_format="json"):
+    # Don't leave a copy in the other format lying around for the later stages to pick up.
+    remove_debate(outdir, filename, out_format)
+
+    out_name = "{0}{1}".format(filename, FORMATS[out_format])
+    out_fp = "{0}/{1}".format(outdir, out_name)
+    data = dump_debate(hansard_debate, out_format)
+    if store_dir is not None:
+        link_file(add_bytes(store_dir, data), out_fp)
+    else:
+        write_replace(data, out_fp)
+
+    return out_name, hashlib.sha256(data).hexdigest()
+
+
+# Gets the row describing a sitting for the manifest, so the later stages don't need to open its json.
+# The date is that of the first contribution, as that's what the later stages have always used.
+def get_sitting_row(hansard_debate, filename, out_name, digest):
+    opener = next(iter(hansard_debate.values()), None)
+    date = None
+    if opener is not None and opener['date'] is not None:
+        try:
+            date = datetime.strptime(opener['date'].strip(), '%d %B %Y').strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+
+    member_ids = []
+    for contribution in hansard_debate.values():
+        if contribution['member'] is not None and contribution['member']['member_id'] not in member_ids:
+            member_ids.append(contribution['member']['member_id'])
+
+    return {"file": out_name,
+            "hansard_file": filename.split(".")[0],
+            "date": date,
+            "chan": int(re.match(r".*CHAN(\d+)", filename).group(1)),
+            "source_id": get_file_id(filename),
+            "contributions": len(hansard_debate),
+            "members": ",".join(str(m) for m in member_ids),
+            "hash": digest}
+
+
+# Hashes a sitting as it streams in and claims its bytes in the content index.
+# The claim is added to claims, to be settled once every file has been processed (see settle_sittings).
+# Returns something etree can parse, or None if a newer copy with the same bytes has already claimed them.
+def dedupe_sitting(filename, stream, index_dir, claims):
+    digest, spooled = spool_and_hash(stream)
+    first_name, replaced_name = claim(index_dir, digest, filename, get_file_id(filename))
+    claims.append((filename, digest, replaced_name))
+    if first_name != filename:
+        spooled.close()
+        return None
+    return spooled
+
+
+# Gets all the sittings in a zip without extracting them, named the same way tidy_files.py names them.
+def get_zip_sittings(zip_fp, index_dir=None, claims=None):
+    zip_fp = zip_fp.replace("\\", "/")
+    zip_id = os.path.basename(zip_fp).split(".")[0]
+
+    # The zip needs to be in a dated directory and have a numeric name, as it would for tidy_files.py.
+    if not re.match(r'.*[\\\/](\d\d\d\d\-\d\d\-\d\d)[\\\/].*', zip_fp) or not zip_id.isdigit():
+        print("Bad file name: ", zip_fp)
+        return
+
+    with zipfile.ZipFile(zip_fp, "r") as curr_archive:
+        for xml_name, xml_file in iter_xmls(curr_archive):
+            filename = "{0}-{1}".format(zip_id, xml_name)
+            if index_dir is None:
+                yield filename, xml_file
+            else:
+                source = dedupe_sitting(filename, xml_file, index_dir, claims)
+                if source is not None:
+                    with source:
+                        yield filename, source
+
+
+# Gets the id number a zip or tidied xml file starts with (-1 if it doesn't have one).
+def get_file_id(fp):
+    m = re.match(r"(\d+)", os.path.basename(fp))
+    return int(m.group(1)) if m else -1
+
+
+# Gets all the zips and xml files in the directory.
+# The newest (highest id) files come first, so when there are byte-identical copies it's the newest we keep.
+def get_all_fps(in_dir):
+    all_fps = []
+    for subdir, dirs, files in os.walk(in_dir):
+        # Skip hidden directories (e.g. a content index).
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for filename in files:
+            # If it's not a zip or an xml file, ignore it.
+            if filename.endswith(".zip") or filename.endswith("xml"):
+                all_fps.append(os.path.join(subdir, filename))
+
+    return sorted(sorted(all_fps), key=get_file_id, reverse=True)
+
+
+# Gets the sittings in a single zip or xml file.
+# Yields the tidy-style file name and something etree can parse.
+# With an index, the claim for each sitting is added to claims.
+def get_sittings(curr_fp, index_dir=None, claims=None):
+    filename = os.path.basename(curr_fp)
+    if filename.endswith(".zip"):
+        yield from get_zip_sittings(curr_fp, index_dir, claims)
+    elif index_dir is None:
+        yield filename, curr_fp
+    else:
+        with open(curr_fp, "rb") as xml_file:
+            source = dedupe_sitting(filename, xml_file, index_dir, claims)
+        if source is not None:
+            with source:
+                yield filename, source
+
+
+# Gets all the sittings in the directory, either as xml files or inside zips.
+def get_all_sittings(in_dir, index_dir=None, claims=None):
+    for curr_fp in get_all_fps(in_dir):
+        yield from get_sittings(curr_fp, index_dir, claims)
+
+
+# Processes every sitting in a zip or xml file and writes each to a json file.
+# This is what each worker runs when processing in parallel, so rather than printing problems it returns them.
+# If given what the manifest knows about the file, it is only processed if its bytes have changed.
+# Returns a summary with the hash of the file, the sittings written, the sections found and any errors,
+# along with the claims made in the content index (if there is one).
+def process_file(curr_fp, outdir, index_dir=None, store_dir=None, streaming=True, seen=None, out_format="json"):
+    summary = {"file": curr_fp, "hash": None, "sittings": [], "rows": [], "sections": set(), "errors": [],
+               "claims": [], "skipped": False, "failed": False}
+    try:
+        summary['hash'] = hash_file(curr_fp)
+        if seen is not None and seen['hash'] == summary['hash']:
+            summary['skipped'] = True
+            return summary
+
+        for filename, source in get_sittings(curr_fp, index_dir, summary['claims']):
+            try:
+                hansard_debate = process_debate(source, filename, summary['sections'], streaming, summary['errors'])
+                out_name, digest = write_debate(hansard_debate, outdir, filename, store_dir, out_format)
+                summary['sittings'].append(filename)
+                summary['rows'].append(get_sitting_row(hansard_debate, filename, out_name, digest))
+            except Exception as e:
+                # A broken sitting shouldn't stop the rest of the file.
+                summary['errors'].append((filename, None, str(e)))
+                summary['failed'] = True
+    except Exception as e:
+        # Neither should a broken zip stop the rest of the files.
+        summary['errors'].append((os.path.basename(curr_fp), None, str(e)))
+        summary['failed'] = True
+
+    return summary
+
+
+# Processes all the files, fanning them out over a pool of processes if n_workers > 1.
+# Returns the summary for each file, in the same order as the files.
+def process_all(all_fps, outdir, n_workers=1, index_dir=None, store_dir=None, streaming=True, seens=None, out_format="json"):
+    n = len(all_fps)
+    seens = [None] * n if seens is None else seens
+    args = (all_fps, [outdir] * n, [index_dir] * n, [store_dir] * n, [streaming] * n, seens, [out_format] * n)
+
+    if n_workers > 1:
+        # Tidied xml files are small, so hand them out a few at a time.
+        chunksize = max(1, n // (n_workers * 16))
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            return list(pool.map(process_file, *args, chunksize=chunksize))
+    else:
+        return list(map(process_file, *args))
+
+
+# Once every file has been processed, settles which copy of each sitting is kept: the newest, however the files
+# were shared out between the workers. The claims are settled in the order the files were handed out,
+# so aliases.tsv comes out the same every time.
+# A copy that isn't kept has its json removed, and is taken out of its file's summary (or out of the manifest,
+# if it was kept by an earlier run). Returns how many copies weren't kept.
+def settle_sittings(summaries, index_dir, outdir, manifest):
+    def remove(filename):
+        remove_debate(outdir, filename)
+        delete_output(manifest, filename)
+
+    claims = [claim for summary in summaries for claim in summary['claims']]
+    kept = settle_claims(index_dir, claims, remove)
+    for summary in summaries:
+        # The sittings and their rows are added to the summary together, so they line up.
+        written = [(filename, row) for filename, row in zip(summary['sittings'], summary['rows']) if filename in kept]
+        summary['sittings'] = [filename for filename, row in written]
+        summary['rows'] = [row for filename, row in written]
+    return len(claims) - len(kept)
 
 
 if __name__ == "__main__":
     # Get the directories from the input parameters.
-    if len(sys.argv) > 1:
-        xmldir = sys.argv[1]
-        outdir = sys.argv[2]
+    # The input directory can be the tidy directory, or the zip directory straight from download_zips.py.
+    # Use --no-dedupe to process every file, even ones whose bytes we've already processed.
+    # Use --store=DIR to keep the json in a content-addressed store and hard link it into the output directory.
+    # Use --tree to load each sitting as a whole tree rather than streaming it.
+    # Use --workers=N to process N files at a time.
+    # Use --format=ndjson to write one contribution per line rather than one json object per sitting.
+    # Use --full to process every file again, rather than just the ones that are new or have changed.
+    full = "--full" in sys.argv
+    dedupe = "--no-dedupe" not in sys.argv
+    streaming = "--tree" not in sys.argv
+    store_dir = None
+    n_workers = 1
+    out_format = "json"
+    for arg in sys.argv[1:]:
+        if arg.startswith("--format="):
+            out_format = arg.split("=", 1)[1]
+            if out_format not in FORMATS:
+                print("Unknown format {0}, pick one of {1}".format(out_format, ", ".join(FORMATS)))
+                sys.exit(1)
+        elif arg.startswith("--store="):
+            store_dir = arg.split("=", 1)[1]
+        elif arg.startswith("--workers="):
+            n_workers = int(arg.split("=")[1])
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    if len(args) > 1:
+        xmldir = args[0]
+        outdir = args[1]
     else:
-        xmldir = input("Enter xml directory:\n") # commons-tidy
+        xmldir = input("Enter xml or zip directory:\n") # commons-tidy or zips
         outdir = input("Enter out directory:\n") # processed_commons
 
     # Create the output directory if need be.
     if not os.path.isdir(outdir):
         os.makedirs(outdir)
 
-    # Have some lists of info that we'll use for debugging/understanding.
-    all_sections = set()
+    # Byte-identical copies of a sitting are recorded in the index rather than processed again.
+    index_dir = get_index_dir(outdir) if dedupe else None
+
+    # The manifest remembers which files have been processed, so we only do the ones that are new or have changed.
+    manifest = open_manifest(get_manifest_fp(outdir))
+    all_fps = []
+    seens = []
+    n_unchanged = 0
+    for curr_fp in get_all_fps(xmldir):
+        seen = None if full else get_input(manifest, os.path.relpath(curr_fp, xmldir))
+        if not is_current(seen, PARSER_VERSION, outdir, FORMATS[out_format]):
+            seen = None
+        # If it doesn't even look like it's changed, don't bother reading it.
+        if seen is not None and is_unmodified(seen, curr_fp):
+            n_unchanged += 1
+            continue
+        all_fps.append(curr_fp)
+        seens.append(seen)
+
+    # Process every sitting and write it to a json file.
+    summaries = process_all(all_fps, outdir, n_workers, index_dir, store_dir, streaming, seens, out_format)
+    if index_dir is not None:
+        n_aliases = settle_sittings(summaries, index_dir, outdir, manifest)
+        print("Skipped {} sittings that were the same as a newer one".format(n_aliases))
+
+    all_errors = []
+    for summary in summaries:
+        all_errors.extend(summary['errors'])
+        path = os.path.relpath(summary['file'], xmldir)
+        if summary['skipped']:
+            n_unchanged += 1
+            record_unmodified(manifest, path, summary['file'])
+        elif not summary['failed']:
+            # Anything this file used to make but doesn't any more is out of date.
+            old_seen = get_input(manifest, path)
+            if old_seen is not None:
+                for sitting in set(old_seen['outputs']) - set(summary['sittings']):
+                    remove_debate(outdir, sitting)
+            record_input(manifest, path, summary['file'], summary['hash'], PARSER_VERSION,
+                         summary['sittings'], summary['sections'], summary['rows'])
+        manifest.commit()
 
-     # iterate through all files and call the find_all_xmls function.
-    for subdir, dirs, files in os.walk(xmldir):
-        for filename in files:
-            # If it's not an xml file, ignore it.
-            if not filename.endswith("xml"):
-                continue
-
-            # Get the filepath for the current xml file.
-            xmlfile = os.path.join(subdir, filename)
-
-            # create element tree object
-            tree = etree.parse(xmlfile)
-
-            # get root element
-            root = tree.getroot()
-            ns_map = root.nsmap
-
-            # Get the tag containing the commons stuff.
-            #house = root.find("{*}House[@name='Commons']")
-            debates = root.find(".//{*}System[@type='Debate']")
-
-            # At the beginning of the debates, set topic to none.
-            curr_topic = None
-            curr_speaker = None
-            curr_question = None
-            curr_para = None
-            curr_section = None
-            curr_department = None
-            curr_section_tag = None
-            curr_xml_file = filename.split(".")[0]
-
-            # Initialise the list of paras for the debate.
-            hansard_debate = dict()
-
-            frag_num=1
-            # Loop through each fragment and extract the debate info.
-            for fragment in debates.iterfind("{*}Fragment"):
-                # Extract the header and find the date of the sitting.
-                header = fragment.find("{*}Header")
-                frag_date = header.find("{*}Sitting").attrib['short-date']
-
-                # Now process the body to get further goodies.
-                body = fragment.find("{*}Body")
-                body_chillens = list(body)
-                for child in body_chillens:
-                    try:
-                        # Get the current tag and remove the namespace.
-                        curr_tag = child.tag
-
-                        # Skip this child if the tag is not a string.
-                        if not isinstance(curr_tag, str):
-                            continue
-
-                        # remove the gubbins from in front of the actual tag
-                        curr_tag = re.match(r"\{.*\}(\w+)", curr_tag).group(1)
-
-                        # Skip this child if the tag is None
-                        if curr_tag is None:
-                            continue
-
-                        # Check which type of element it is and process accordingly.
-                        # Check if it is a Section marker
-                        if re.fullmatch("hs_2\w+", curr_tag):
-                            curr_section = etree.tostring(child, method="text", encoding="unicode")
-                            curr_section = curr_section.replace("\n", " ").strip()
-                            all_sections.add((curr_section, curr_tag))
-                            add_para(curr_para, hansard_debate)
-                            # Set everything to be None
-                            curr_para = None
-                            curr_topic = None
-                            curr_speaker = None
-                            curr_department = None
-                            curr_question = None
-                            curr_section_tag = curr_tag
-
-                        # Check if it's an Oral Answers marker (for some reason separate)
-                        elif re.fullmatch("hs_3OralAnswers", curr_tag):
-                            if child.text is not None:
-                                curr_section = child.text.replace("\n", " ").strip()
-                                all_sections.add((curr_section, curr_tag))
-                                add_para(curr_para, hansard_debate)
-                                # Set everything to be None
-                                curr_para = None
-                                curr_topic = None
-                                curr_speaker = None
-                                curr_department = None
-                                curr_question = None
-                                # Update the current section tag
-                                curr_section_tag = curr_tag
-                            else:
-                                pass
-
-                         # Check if it's a Department tag.
-                        elif re.fullmatch("hs_6bDepartment", curr_tag):
-                            department = child.find(".//{*}DepartmentName")
-                            if department is not None:
-                                if department.text is not None:
-                                    curr_department = department.text.replace("\n", " ").strip()
-                                else:
-                                    pass
-                            else:
-                                pass
-
-                        # Check if it is a question topic.
-                        elif re.fullmatch("hs_8\w+", curr_tag):
-                            if child.text is not None:
-                                topic = child.text.replace("\n", " ").strip()
-                                curr_topic = topic
-                            else:
-                                pass
-
-                        # Check if it is a question.
-                        elif curr_tag == "Question":
-                            # Ignore certain sections.
-                            if curr_section_tag == "hs_2BusinessWODebate":
-                                continue
-
-                            # Questions contain a normal para element.
-                            question = process_question(child)
-
-                            # Set the current speaker in case next paragraph doesn't specify.
-                            curr_speaker = question['member']
-
-                            # Set the topic.
-                            question['topic'] = curr_topic
-
-                            # Set the department
-                            question['department'] = curr_department
-
-                            # Set the section
-                            question['section'] = curr_section
-                            question['section_tag'] = curr_section_tag
-
-                            # Set the time
-                            question['date'] = frag_date
-
-                            # Set the file it's from.
-                            question['hansard_file'] = curr_xml_file
-
-                            # Set the current question.
-                            curr_question = question
-
-                            # Add the current paragraph first to maintain order.
-                            add_para(curr_para, hansard_debate)
-                            curr_para = None
-
-                            # Add question to debate list
-                            add_para(question, hansard_debate)
-
-                        # Check if it is just a paragraph of speech.
-                        elif curr_tag == "hs_Para":
-                            # Ignore certain sections.
-                            if curr_section_tag == "hs_2BusinessWODebate":
-                                continue
-
-                            # Get the paragraph deets.
-                            para = process_para(child)
-
-                            # Set the topic.
-                            # para['topic'] = curr_topic
-
-                            # Only set the question if it is the answers section.
-                            if curr_section_tag == "hs_3OralAnswers":
-                                para['question'] = curr_question
-
-                            # Set the date and the section.
-                            para['date'] = frag_date
-                            para['section'] = curr_section
-                            para['section_tag'] = curr_section_tag
-                            # Set the file it's from.
-                            para['hansard_file'] = curr_xml_file
-
-                            # Set the current speaker in case next paragraph doesn't specify.
-                            if para['member'] is not None:
-                                # Add the previous paragraph to the list.
-                                add_para(curr_para, hansard_debate)
-                                # Update the current paragraph.
-                                curr_para = para
-                                curr_speaker = para['member']
-                            else:
-                                # If speaker wasn't recorded, it is the previous speaker.
-                                para['member'] = curr_speaker
-                                # If this is just a continuation, add the text to the previous para.
-                                if curr_para is not None:
-                                    curr_para['text'] = "{0} {1}".format(curr_para['text'], para['text'])
-
-                        # Check if it is a quote.
-                        elif curr_tag == "hs_brev":
-                            quote_text = child.text
-                            if curr_para is not None and quote_text is not None:
-                                quote_text = quote_text.replace("\n", " ").strip()
-                                if re.match(r'[\“\'\"].+[\”\'\"]', quote_text):
-                                    curr_para['text'] = "{0} {1}".format(curr_para['text'], quote_text)
-
-
-                    except Exception as e:
-                        print("Problems processing {}".format(child.tag))
-                        print(e)
-                frag_num += 1
-                add_para(curr_para, hansard_debate)
-
-            # Writes this debate to a json file.
-            with open("{0}/{1}.json".format(outdir, filename), "w") as out_file:
-                json.dump(hansard_debate, out_file)
-
-with open("section_file.json", "w") as section_file:
-    json.dump(list(all_sections), section_file)
+    # Have some lists of info that we'll use for debugging/understanding.
+    all_sections = get_all_sections(manifest)
+    manifest.close()
+
+    print("Processed {0} sittings from {1} files ({2} files unchanged)".format(sum(len(s['sittings']) for s in summaries),
+                                                                           len(summaries) - sum(s['skipped'] for s in summaries),
+                                                                           n_unchanged))
+    if all_errors:
+        print("{} problems:".format(len(all_errors)))
+        for filename, tag, error in all_errors:
+            if tag is not None:
+                print("Problems processing {0} in {1}".format(tag, filename))
+            else:
+                print("Problems processing {}".format(filename))
+            if error is not None:
+                print("    {}".format(error))
+
+    with open("section_file.json", "w") as section_file:
+        json.dump(list(all_sections), section_file)
@@ -0,0 +1,187 @@
+# Keeps a record of every zip or xml file process_xml.py has turned into json.
+# Each file is recorded with the hash of its bytes and the version of the parser that processed it,
+# so re-running only has to parse files that are new, have changed, or were done by an older parser.
+# There is also a row for each sitting (its date, CHAN number, id, etc.), so the later stages
+# can decide what to do with a sitting without opening its json.
+import os
+import sqlite3
+import hashlib
+from datetime import datetime
+
+
+MANIFEST_NAME = "manifest.db"
+CHUNK_SIZE = 1024 * 1024
+
+sql_create_inputs = """
+CREATE TABLE IF NOT EXISTS inputs (
+    path text PRIMARY KEY,
+    hash text NOT NULL,
+    parser_version integer NOT NULL,
+    size integer,
+    mtime integer,
+    processed_at text NOT NULL
+);"""
+
+sql_create_outputs = """
+CREATE TABLE IF NOT EXISTS outputs (
+    path text NOT NULL,
+    sitting text NOT NULL,
+    PRIMARY KEY (path, sitting),
+    FOREIGN KEY (path) REFERENCES inputs (path)
+);"""
+
+sql_create_sittings = """
+CREATE TABLE IF NOT EXISTS sittings (
+    file text PRIMARY KEY,
+    path text,
+    hansard_file text NOT NULL,
+    date text,
+    chan integer NOT NULL,
+    source_id integer NOT NULL,
+    contributions integer NOT NULL,
+    members text,
+    hash text
+);"""
+
+SITTING_COLUMNS = ["file", "path", "hansard_file", "date", "chan", "source_id", "contributions", "members", "hash"]
+
+sql_create_sections = """
+CREATE TABLE IF NOT EXISTS sections (
+    path text NOT NULL,
+    section text,
+    tag text,
+    FOREIGN KEY (path) REFERENCES inputs (path)
+);"""
+
+
+def get_manifest_fp(out_dir):
+    return os.path.join(out_dir, MANIFEST_NAME)
+
+
+def open_manifest(fp):
+    connection = sqlite3.connect(fp)
+    connection.execute(sql_create_inputs)
+    connection.execute(sql_create_outputs)
+    connection.execute(sql_create_sections)
+    connection.execute(sql_create_sittings)
+    connection.commit()
+    return connection
+
+
+def hash_file(fp):
+    digest = hashlib.sha256()
+    with open(fp, "rb") as in_file:
+        for chunk in iter(lambda: in_file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Gets what we know about an input file, along with the sittings it was turned into.
+def get_input(connection, path):
+    command = '''SELECT path, hash, parser_version, size, mtime, processed_at
+                FROM inputs WHERE path = ?;'''
+    row = connection.execute(command, (path,)).fetchone()
+    if row is None:
+        return None
+
+    seen = dict(zip(["path", "hash", "parser_version", "size", "mtime", "processed_at"], row))
+    command = '''SELECT sitting FROM outputs WHERE path = ? ORDER BY sitting;'''
+    seen['outputs'] = [r[0] for r in connection.execute(command, (path,))]
+    return seen
+
+
+# Checks whether what we made from an input file last time can still be used (if the file hasn't changed).
+def is_current(seen, parser_version, out_dir, extension=".json"):
+    if seen is None or seen['parser_version'] != parser_version:
+        return False
+
+    # If any of the json has gone missing we need to make it again.
+    for sitting in seen['outputs']:
+        if not os.path.isfile(os.path.join(out_dir, "{0}{1}".format(sitting, extension))):
+            return False
+
+    return True
+
+
+# Checks whether the file looks the same as last time without reading it (same size and modification time).
+def is_unmodified(seen, fp):
+    stat = os.stat(fp)
+    return seen['size'] == stat.st_size and seen['mtime'] == stat.st_mtime_ns
+
+
+# Records that an input file has been processed into the given sittings, replacing what we knew before.
+# The sections found in it are kept too, so the full list can be made without parsing everything again.
+def record_input(connection, path, fp, digest, parser_version, outputs, sections, sittings=()):
+    stat = os.stat(fp)
+    command = '''INSERT INTO inputs(path, hash, parser_version, size, mtime, processed_at)
+                VALUES(?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET hash=excluded.hash, parser_version=excluded.parser_version,
+                size=excluded.size, mtime=excluded.mtime, processed_at=excluded.processed_at;'''
+    curr_entry = (path, digest, parser_version, stat.st_size, stat.st_mtime_ns, datetime.now().isoformat())
+    connection.execute(command, curr_entry)
+
+    connection.execute("DELETE FROM outputs WHERE path = ?;", (path,))
+    command = '''INSERT INTO outputs(path, sitting)
+                VALUES(?, ?);'''
+    connection.executemany(command, [(path, sitting) for sitting in outputs])
+
+    connection.execute("DELETE FROM sections WHERE path = ?;", (path,))
+    command = '''INSERT INTO sections(path, section, tag)
+                VALUES(?, ?, ?);'''
+    connection.executemany(command, [(path, section, tag) for section, tag in sections])
+
+    connection.execute("DELETE FROM sittings WHERE path = ?;", (path,))
+    record_sittings(connection, [dict(sitting, path=path) for sitting in sittings])
+
+
+# Records that a file's bytes hadn't changed, even though its modification time had.
+def record_unmodified(connection, path, fp):
+    stat = os.stat(fp)
+    command = '''UPDATE inputs SET size = ?, mtime = ? WHERE path = ?;'''
+    connection.execute(command, (stat.st_size, stat.st_mtime_ns, path))
+
+
+# Gets every section found in every file we know about.
+def get_all_sections(connection):
+    return set(connection.execute("SELECT DISTINCT section, tag FROM sections;"))
+
+
+# Records a row for each sitting, replacing any there already for the same file.
+def record_sittings(connection, sittings):
+    command = '''INSERT OR REPLACE INTO sittings({0})
+                VALUES({1});'''.format(", ".join(SITTING_COLUMNS), ", ".join(["?"] * len(SITTING_COLUMNS)))
+    connection.executemany(command, [tuple(sitting.get(c) for c in SITTING_COLUMNS) for sitting in sittings])
+
+
+# Forgets every sitting, so the ones recorded next are the only ones there.
+def clear_sittings(connection):
+    connection.execute("DELETE FROM sittings;")
+
+
+def delete_sitting(connection, filename):
+    connection.execute("DELETE FROM sittings WHERE file = ?;", (filename,))
+
+
+# Forgets a sitting that's no longer made from its input file (e.g. it turned out to be a copy of a newer one).
+# The sitting is named as in the outputs, e.g. 100005-CHAN1.xml.
+def delete_output(connection, sitting):
+    connection.execute("DELETE FROM outputs WHERE sitting = ?;", (sitting,))
+    connection.execute("DELETE FROM sittings WHERE hansard_file = ?;", (sitting.split(".")[0],))
+
+
+# Gets the row for every sitting, ordered by file name.
+def get_sittings(connection):
+    command = '''SELECT {} FROM sittings ORDER BY file;'''.format(", ".join(SITTING_COLUMNS))
+    return [dict(zip(SITTING_COLUMNS, row)) for row in connection.execute(command)]
+
+
+# Gets the rows for the sittings in a directory's manifest, or None if it hasn't got one.
+def read_sittings(dir_fp):
+    manifest_fp = get_manifest_fp(dir_fp)
+    if not os.path.isfile(manifest_fp):
+        return None
+
+    connection = open_manifest(manifest_fp)
+    sittings = get_sittings(connection)
+    connection.close()
+    return sittings
@@ -1,18 +1,63 @@
 import os
 import re
-import json
 import sys
-from shutil import copyfile
+from object_store import link_file
+from debate_io import is_debate_file, get_first_contribution, get_partition_dir
+from processing_manifest import get_manifest_fp, open_manifest, read_sittings, record_sittings, clear_sittings
 from datetime import datetime
 
 
 def get_all_files(dir_path):
     for subdir, dirs, files in os.walk(dir_path):
+        # Skip hidden directories (e.g. the content index from process_xml.py).
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
         for filename in files:
             yield os.path.join(subdir, filename).replace("\\", "/")
             # yield "{0}/{1}".format(subdir, filename)
 
 
+# Gets the date, CHAN number and id of each debate file, keyed by the file's name.
+# These come from the manifest process_xml.py wrote, and the files are only opened if it doesn't cover them all.
+# Also says whether they came from the manifest.
+def get_sitting_info(deb_dir, debs):
+    sittings = read_sittings(deb_dir)
+    if sittings is not None:
+        sittings = {sitting['file']: sitting for sitting in sittings}
+        if all(os.path.basename(f) in sittings for f in debs):
+            return sittings, True
+
+    sittings = dict()
+    for f in debs:
+        file_match = re.fullmatch(r"(.*\/)?(\d+)\-CHAN(\d+)\.xml\.(nd)?json", f)
+        # Only the date of the first contribution is needed.
+        debate = get_first_contribution(f, ["date"])
+        date = None
+        if debate is not None:
+            date = datetime.strptime(debate['date'].strip(), '%d %B %Y').strftime('%Y-%m-%d')
+        sittings[os.path.basename(f)] = {"file": os.path.basename(f), "date": date,
+                                         "chan": int(file_match.group(3)), "source_id": int(file_match.group(2))}
+    return sittings, False
+
+
+# Gets the debates to keep: if debates have the same number and date then one is a new version,
+# so only the most recent (highest id) of them is kept.
+# Done in one pass by grouping on (number, date), and keeps the debates in the order they were given.
+def get_files_to_keep(debs, sittings):
+    newest = dict()
+    for f in debs:
+        sitting = sittings[os.path.basename(f)]
+        key = (sitting['chan'], sitting['date'])
+        if key not in newest or sitting['source_id'] > newest[key]:
+            newest[key] = sitting['source_id']
+
+    files_to_keep = []
+    for f in debs:
+        sitting = sittings[os.path.basename(f)]
+        if sitting['source_id'] == newest[(sitting['chan'], sitting['date'])]:
+            files_to_keep.append(f)
+    return files_to_keep
+
+
 if __name__ == "__main__":
     # Get the directories from the input parameters.
     if len(sys.argv) > 1:
@@ -27,57 +72,42 @@ if __name__ == "__main__":
         os.makedirs(out_dir)
 
     all_files = get_all_files(deb_dir)
-    debs = [f for f in all_files]
-    files_to_keep = [deb for deb in debs]
-
-    for debate_file in debs:
-        for comparison_file in debs:
-            # Skip if it's just the same file.
-            if debate_file == comparison_file:
-                continue
-
-            # Use a regex to match the file name and identify relevant groups.
-            deb_match = re.fullmatch(r"(.*\/)?(\d+)\-CHAN(\d+)\.xml\.json", debate_file)
-            com_match = re.fullmatch(r"(.*\/)?(\d+)\-CHAN(\d+)\.xml\.json", comparison_file)
-
-            # Get the number of this hansard edition.
-            deb_num = deb_match.group(3)
-            com_num = com_match.group(3)
-
-            # Get the unique ID part of the file.
-            deb_id = deb_match.group(2)
-            com_id = com_match.group(2)
-
-            # Checks if these two debates have the same number.
-            if deb_num == com_num:
-                with open(debate_file) as debfile:
-                    debate = json.load(debfile)
-
-                with open(comparison_file) as comfile:
-                    comparison = json.load(comfile)
-
-                # Checks if they have the same date. If they do, then one is a new version.
-                if list(debate.values())[0]['date'] == list(comparison.values())[0]['date']:
-                    # If the current file is more recent, get rid of the comparison.
-                    if int(deb_id) > int(com_id):
-                        if comparison_file in files_to_keep:
-                            files_to_keep.remove(comparison_file)
-
-                else:
-                    pass
+    # Only the json (not e.g. the manifest from process_xml.py).
+    debs = [f for f in all_files if is_debate_file(f)]
+    sittings, from_manifest = get_sitting_info(deb_dir, debs)
+    files_to_keep = get_files_to_keep(debs, sittings)
 
     # Go through the files we want to keep.
+    kept_sittings = []
     for f in files_to_keep:
         # Find the date of the current file
-        with open(f) as debfile:
-            debate = json.load(debfile)
-        # Format the date to remove spaces
-        date = list(debate.values())[0]['date'].strip()
-        date = datetime.strptime(date, '%d %B %Y').strftime('%Y-%m-%d')
+        sitting = sittings[os.path.basename(f)]
+        date = sitting['date']
+        # Nothing was said in it, so there's nothing to keep.
+        if date is None:
+            print("Skipping {}, it has no date".format(f))
+            continue
 
         # Get the actual file name bit and make the output file name.
-        file_match = re.fullmatch(r"(.*\/)?(\d+)\-(CHAN\d+)\.xml\.json", f)
-        ou_fp = os.path.join(out_dir, "{1}-{0}.json".format(file_match.group(3), date))
-        # Copy the file across.
-        copyfile(f, ou_fp)
+        file_match = re.fullmatch(r"(.*\/)?(\d+)\-(CHAN\d+)\.xml\.((nd)?json)", f)
+        ou_name = "{1}-{0}.{2}".format(file_match.group(3), date, file_match.group(4))
+        # Each debate goes in the year=/month= directory for its date.
+        ou_dir = get_partition_dir(out_dir, date)
+        os.makedirs(ou_dir, exist_ok=True)
+        # Link the file across (rather than copying it).
+        link_file(f, os.path.join(ou_dir, ou_name))
+        kept_sittings.append(dict(sitting, file=ou_name))
+
+    # Pass the manifest rows on, so the later stages don't need to open the files either.
+    # Only the sittings kept this time are in it, whatever an earlier run left there.
+    manifest_fp = get_manifest_fp(out_dir)
+    if from_manifest:
+        manifest = open_manifest(manifest_fp)
+        clear_sittings(manifest)
+        record_sittings(manifest, kept_sittings)
+        manifest.commit()
+        manifest.close()
+    elif os.path.isfile(manifest_fp):
+        # Without one the later stages read the files, so don't leave them an old manifest to trust instead.
+        os.remove(manifest_fp)
     pass
@@ -1,11 +1,14 @@
 import os
 import re
 import random
+from debate_io import is_debate_file
 
 def get_all_files(dir_path):
     for subdir, dirs, files in os.walk(dir_path):
         for filename in files:
-            yield filename
+            # Only the debates (not e.g. the manifest).
+            if is_debate_file(filename):
+                yield filename
 
 def get_files_from_year(all_files, year):
     for f in all_files:
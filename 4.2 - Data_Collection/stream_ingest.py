@@ -0,0 +1,202 @@
+# Builds the database straight from the zips in a single pass, without writing any of the directories in between.
+# The sittings are read out of the (nested) zips and parsed by a pool of workers, and as each comes back
+# older versions of a sitting are dropped, anything outside the dates is dropped, and the rest goes into the database.
+# Only a few zips are being worked on at any one time, and contributions waiting on their member are kept in the database,
+# so the memory used doesn't grow with the size of the corpus.
+# Run with
+#   python stream_ingest.py ZIP_DIR DB_PATH [START [END]] [--workers=N]
+# where START and END are dates like 2015-05-07. This gives the same database as running parse_zips.sh.
+# With just START, everything from then on is used.
+import re
+import sys
+import json
+import time
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from process_xml import get_all_fps, get_sittings, process_debate, get_file_id
+from make_db import create_connection, create_tables, set_load_pragmas, set_normal_pragmas, create_indexes, analyze_db
+from make_db import insert_rows, BATCH_SIZE
+from make_db import add_members, add_contributions, get_debate_ids, get_debate_id, get_contribution_rows, add_member_key
+from make_db import is_valid_member_id, get_member_index
+from make_db import sql_insert_contribution
+
+
+# How many zips each worker can have waiting to be dealt with.
+IN_FLIGHT_PER_WORKER = 2
+
+# Contributions waiting for their member to be looked up are kept in the database rather than in memory.
+# Anything left over from a run that didn't finish is thrown away.
+sql_create_pending = ["DROP TABLE IF EXISTS pending_contributions;",
+                      "CREATE TABLE pending_contributions (contribution text NOT NULL);"]
+sql_insert_pending = '''INSERT INTO pending_contributions(contribution)
+                VALUES(?);'''
+
+
+# Parses every sitting in a zip or xml file.
+# Returns a summary for each sitting (its name, date, number, id and contributions) along with any problems.
+def parse_file(curr_fp):
+    sittings = []
+    errors = []
+    try:
+        for filename, source in get_sittings(curr_fp):
+            try:
+                hansard_debate = process_debate(source, filename, set(), True, errors)
+            except Exception as e:
+                errors.append((filename, None, str(e)))
+                continue
+
+            contributions = list(hansard_debate.values())
+            # The date is that of the first contribution, as remove_duplicates.py uses.
+            date = None
+            if contributions and contributions[0]['date'] is not None:
+                try:
+                    date = datetime.strptime(contributions[0]['date'].strip(), '%d %B %Y').strftime('%Y-%m-%d')
+                except ValueError:
+                    errors.append((filename, None, "Bad date {}".format(contributions[0]['date'])))
+
+            sittings.append({"filename": filename,
+                             "date": date,
+                             "chan": int(re.match(r".*CHAN(\d+)", filename).group(1)),
+                             "source_id": get_file_id(filename),
+                             "contributions": contributions})
+    except Exception as e:
+        errors.append((curr_fp, None, str(e)))
+
+    return sittings, errors
+
+
+# Parses the files in order, with no more than max_in_flight of them being worked on at once.
+# Yields the result for each file in the same order as the files.
+def parse_all(all_fps, n_workers=1, max_in_flight=None):
+    if n_workers <= 1:
+        for curr_fp in all_fps:
+            yield parse_file(curr_fp)
+        return
+
+    max_in_flight = n_workers * IN_FLIGHT_PER_WORKER if max_in_flight is None else max_in_flight
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        in_flight = deque()
+        for curr_fp in all_fps:
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+            in_flight.append(pool.submit(parse_file, curr_fp))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def hold_contributions(connection, contributions):
+    insert_rows(connection, sql_insert_pending, ((json.dumps(contribution),) for contribution in contributions))
+
+
+# Gets back the contributions that were held, in the order they were held, BATCH_SIZE at a time.
+def get_held_contributions(connection):
+    last_id = 0
+    while True:
+        command = '''SELECT rowid, contribution FROM pending_contributions
+                    WHERE rowid > ? ORDER BY rowid LIMIT ?;'''
+        rows = connection.execute(command, (last_id, BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        for row_id, contribution in rows:
+            yield json.loads(contribution)
+        last_id = rows[-1][0]
+
+
+# Streams every sitting in the directory into the database.
+# The files come newest (highest id) first, so the first version of a sitting (same number and date) we see is the one kept.
+# Contributions whose member has no PimsId are held back in the database until the members are known, then added at the end.
+def ingest(zip_dir, connection, start=None, end=None, n_workers=1):
+    seen_sittings = set()
+    debate_ids = get_debate_ids(connection)
+    members = []
+    seen_members = set()
+    errors = []
+    for command in sql_create_pending:
+        connection.execute(command)
+    counts = {"files": 0, "sittings": 0, "versions": 0, "out_of_range": 0, "contributions": 0}
+
+    for sittings, file_errors in parse_all(get_all_fps(zip_dir), n_workers):
+        counts['files'] += 1
+        errors.extend(file_errors)
+        for sitting in sittings:
+            # Nothing was said in it, so there's nothing to keep.
+            if sitting['date'] is None:
+                continue
+
+            # Drop older versions of sittings we already have.
+            key = (sitting['chan'], sitting['date'])
+            if key in seen_sittings:
+                counts['versions'] += 1
+                continue
+            seen_sittings.add(key)
+
+            # Drop anything outside the dates.
+            if (start is not None and sitting['date'] < start) or (end is not None and sitting['date'] > end):
+                counts['out_of_range'] += 1
+                continue
+
+            contributions = sitting['contributions']
+            for contribution in contributions:
+                add_member_key(members, seen_members, contribution['member'])
+
+            get_debate_id(connection, debate_ids, contributions[0])
+            valid = [c for c in contributions if is_valid_member_id(c['member']['member_id'])]
+            insert_rows(connection, sql_insert_contribution, get_contribution_rows([valid], debate_ids))
+            hold_contributions(connection, [c for c in contributions if not is_valid_member_id(c['member']['member_id'])])
+
+            counts['sittings'] += 1
+            counts['contributions'] += len(contributions)
+
+    # Now we know everyone who spoke, look them up and add the contributions that needed them.
+    member_index = get_member_index(add_members(members, connection))
+    add_contributions([get_held_contributions(connection)], member_index, connection)
+    connection.execute("DROP TABLE pending_contributions;")
+    connection.commit()
+
+    return counts, errors
+
+
+if __name__ == "__main__":
+    n_workers = 1
+    for arg in sys.argv[1:]:
+        if arg.startswith("--workers="):
+            n_workers = int(arg.split("=")[1])
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    if len(args) > 1:
+        zip_dir = args[0]
+        db_fp = args[1]
+    else:
+        zip_dir = input("Enter Zip Directory: ")
+        db_fp = input("Enter DB FP: ")
+    start = args[2] if len(args) > 2 else None
+    end = args[3] if len(args) > 3 else None
+
+    connection = create_connection(db_fp)
+    if connection is None:
+        print("Cannot connect to Database.")
+        sys.exit(1)
+    create_tables(connection)
+    set_load_pragmas(connection)
+
+    start_time = time.perf_counter()
+    counts, errors = ingest(zip_dir, connection, start, end, n_workers)
+    create_indexes(connection)
+    analyze_db(connection)
+    set_normal_pragmas(connection)
+    connection.close()
+
+    print("Added {0} sittings ({1} contributions) from {2} files in {3:.1f} seconds".format(
+        counts['sittings'], counts['contributions'], counts['files'], time.perf_counter() - start_time))
+    print("Dropped {0} older versions and {1} sittings outside the dates".format(counts['versions'], counts['out_of_range']))
+    if errors:
+        print("{} problems:".format(len(errors)))
+        for filename, tag, error in errors:
+            if tag is not None:
+                print("Problems processing {0} in {1}".format(tag, filename))
+            else:
+                print("Problems processing {}".format(filename))
+            if error is not None:
+                print("    {}".format(error))
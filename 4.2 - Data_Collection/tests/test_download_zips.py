@@ -0,0 +1,313 @@
+# Tests for download_zips.py against a stand-in for the parliament server, run locally with http.server.
+# It serves an Atom feed and some zips, understands Range requests, and can be told to fail the next few requests
+# for a zip (with a 503, by cutting the body short, or by ignoring the Range header).
+import io
+import os
+import sqlite3
+import threading
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import http_cache
+import download_zips
+from download_zips import download_zip, download_all, download_zips as download_feed, get_atom_resources, needs_download
+from download_manifest import open_manifest, record_entry, record_download, get_entry, is_new_or_changed
+
+
+def make_zip(name, size):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        # Random bytes don't compress, so the zip is about as big as asked.
+        archive.writestr("{}.xml".format(name), os.urandom(size))
+    return data.getvalue()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fake = self.server.fake
+        with fake.lock:
+            fake.requests.append((self.path, self.headers.get("Range")))
+            name = self.path.split("/")[-1]
+            plan = fake.plans.get(name, [])
+            action = plan.pop(0) if plan else None
+
+        if self.path == "/feed":
+            self.send_body(200, fake.get_feed(), [("Content-Type", "application/atom+xml")])
+            return
+        if name not in fake.zips:
+            self.send_body(404, b"")
+            return
+        if action == "fail":
+            self.send_body(503, b"")
+            return
+
+        data = fake.zips[name]
+        headers = [("ETag", '"{}"'.format(name))]
+        start = 0
+        requested = self.headers.get("Range")
+        if requested is not None and action != "ignore-range":
+            start = int(requested.split("=")[1].rstrip("-"))
+            if start >= len(data):
+                self.send_body(416, b"", [("Content-Range", "bytes */{}".format(len(data)))])
+                return
+            status = 206
+            headers.append(("Content-Range", "bytes {0}-{1}/{2}".format(start, len(data) - 1, len(data))))
+        else:
+            status = 200
+
+        body = data[start:]
+        if action == "truncate":
+            # Say it's all coming, then hang up halfway through.
+            self.send_response(status)
+            for key, value in headers:
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.send_body(status, body, headers)
+
+
+class FakeParliament:
+    def __init__(self):
+        self.zips = dict()
+        self.plans = dict()
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHandler)
+        self.server.fake = self
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def get_zip_url(self, name):
+        return "{0}/zips/{1}".format(self.url, name)
+
+    def get_feed(self):
+        entries = ['''<entry><title>{0}</title><id>{1}</id><updated>2019-06-03T10:00:00Z</updated>
+                   <link rel="enclosure" href="{1}" length="{2}"/></entry>'''.format(name, self.get_zip_url(name), len(data))
+                   for name, data in sorted(self.zips.items())]
+        # Anything that isn't a zip should be left alone.
+        entries.append('''<entry><title>notes</title><id>{0}/notes.pdf</id><updated>2019-06-03T10:00:00Z</updated>
+                       <link rel="enclosure" href="{0}/notes.pdf" length="10"/></entry>'''.format(self.url))
+        return '''<?xml version="1.0" encoding="utf-8"?>
+                  <feed xmlns="http://www.w3.org/2005/Atom"><title>Hansard</title>{}</feed>'''.format("".join(entries)).encode("utf-8")
+
+    def get_ranges(self, name):
+        return [requested for path, requested in self.requests if path == "/zips/{}".format(name)]
+
+
+@pytest.fixture
+def fake():
+    fake = FakeParliament()
+    thread = threading.Thread(target=fake.server.serve_forever, daemon=True)
+    thread.start()
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+
+# Nothing should really be slept for, but the waits are remembered.
+@pytest.fixture
+def sleeps(monkeypatch, tmp_path):
+    waited = []
+    monkeypatch.setattr(download_zips.time, "sleep", waited.append)
+    # The discard pile is written to the working directory.
+    monkeypatch.chdir(tmp_path)
+    return waited
+
+
+def read(fp):
+    with open(fp, "rb") as in_file:
+        return in_file.read()
+
+
+def test_download(fake, sleeps, tmp_path):
+    fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    out_fp, headers = download_zip(fake.get_zip_url("100001.zip"), str(tmp_path))
+
+    assert out_fp == "{}/100001.zip".format(tmp_path)
+    assert read(out_fp) == fake.zips["100001.zip"]
+    assert headers["ETag"] == '"100001.zip"'
+    assert not os.path.exists("{}.part".format(out_fp))
+    assert fake.get_ranges("100001.zip") == [None]
+
+
+def test_already_downloaded(fake, sleeps, tmp_path):
+    fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    (tmp_path / "100001.zip").write_bytes(b"already here")
+
+    assert download_zip(fake.get_zip_url("100001.zip"), str(tmp_path)) == ("{}/100001.zip".format(tmp_path), None)
+    assert fake.requests == []
+
+
+def test_resume_from_part(fake, sleeps, tmp_path):
+    data = fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    (tmp_path / "100001.zip.part").write_bytes(data[:2000])
+
+    out_fp, headers = download_zip(fake.get_zip_url("100001.zip"), str(tmp_path))
+
+    assert read(out_fp) == data
+    assert fake.get_ranges("100001.zip") == ["bytes=2000-"]
+
+
+def test_resume_when_server_ignores_range(fake, sleeps, tmp_path):
+    data = fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    fake.plans["100001.zip"] = ["ignore-range"]
+    (tmp_path / "100001.zip.part").write_bytes(data[:2000])
+
+    out_fp, headers = download_zip(fake.get_zip_url("100001.zip"), str(tmp_path))
+
+    # The whole thing came again, so it mustn't be added on to what we had.
+    assert read(out_fp) == data
+
+
+def test_part_already_complete(fake, sleeps, tmp_path):
+    data = fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    (tmp_path / "100001.zip.part").write_bytes(data)
+
+    out_fp, headers = download_zip(fake.get_zip_url("100001.zip"), str(tmp_path))
+
+    assert read(out_fp) == data
+    assert fake.get_ranges("100001.zip") == ["bytes={}-".format(len(data))]
+    assert sleeps == []
+
+
+def test_bad_part_is_started_again(fake, sleeps, tmp_path):
+    data = fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    # Longer than the file, so the server can only say 416 and it's no use.
+    (tmp_path / "100001.zip.part").write_bytes(b"x" * (len(data) + 100))
+
+    out_fp, headers = download_zip(fake.get_zip_url("100001.zip"), str(tmp_path), backoff=2)
+
+    assert read(out_fp) == data
+    assert fake.get_ranges("100001.zip") == ["bytes={}-".format(len(data) + 100), None]
+    assert sleeps == [2]
+
+
+def test_resume_after_cut_off(fake, sleeps, tmp_path, monkeypatch):
+    # Small chunks, so some of the body is on disk by the time the connection goes.
+    monkeypatch.setattr(download_zips, "CHUNK_SIZE", 512)
+    data = fake.zips["100001.zip"] = make_zip("CHAN1", 20000)
+    fake.plans["100001.zip"] = ["truncate"]
+
+    out_fp, headers = download_zip(fake.get_zip_url("100001.zip"), str(tmp_path), backoff=2)
+
+    assert read(out_fp) == data
+    first, second = fake.get_ranges("100001.zip")
+    assert first is None
+    assert second is not None and 0 < int(second.split("=")[1].rstrip("-")) <= len(data) // 2
+    assert sleeps == [2]
+
+
+def test_retry_with_backoff(fake, sleeps, tmp_path):
+    data = fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    fake.plans["100001.zip"] = ["fail", "fail", "fail"]
+
+    out_fp, headers = download_zip(fake.get_zip_url("100001.zip"), str(tmp_path), retries=5, backoff=2)
+
+    assert read(out_fp) == data
+    assert len(fake.get_ranges("100001.zip")) == 4
+    assert sleeps == [2, 4, 8]
+
+
+def test_give_up(fake, sleeps, tmp_path):
+    fake.zips["100001.zip"] = make_zip("CHAN1", 5000)
+    fake.plans["100001.zip"] = ["fail"] * 3
+    url = fake.get_zip_url("100001.zip")
+
+    assert download_zip(url, str(tmp_path), retries=3, backoff=2) == (None, None)
+    assert len(fake.get_ranges("100001.zip")) == 3
+    # No point waiting after the last try.
+    assert sleeps == [2, 4]
+    assert read("zip_discard_pile.txt") == "{}\n".format(url).encode("utf-8")
+    assert not os.path.exists(str(tmp_path / "100001.zip"))
+
+
+def test_download_all(fake, sleeps, tmp_path):
+    for i in range(1, 7):
+        fake.zips["10000{}.zip".format(i)] = make_zip("CHAN{}".format(i), 3000 + i)
+    fake.plans["100002.zip"] = ["fail", "truncate"]
+    fake.plans["100005.zip"] = ["fail"] * download_zips.MAX_RETRIES
+    (tmp_path / "100003.zip.part").write_bytes(fake.zips["100003.zip"][:1000])
+
+    manifest = open_manifest(str(tmp_path / "manifest.db"))
+    jobs = []
+    for name in sorted(fake.zips):
+        entry = {"link": fake.get_zip_url(name), "title": name, "updated": "2019-06-03T10:00:00Z"}
+        record_entry(manifest, entry, "{0}/{1}".format(tmp_path, name))
+        jobs.append((entry['link'], str(tmp_path)))
+
+    downloaded = download_all(jobs, n_workers=4, manifest=manifest)
+
+    assert sorted(os.path.basename(fp) for fp in downloaded) == ["100001.zip", "100002.zip", "100003.zip", "100004.zip", "100006.zip"]
+    for fp in downloaded:
+        assert read(fp) == fake.zips[os.path.basename(fp)]
+    assert fake.get_ranges("100003.zip") == ["bytes=1000-"]
+
+    statuses = dict(sqlite3.connect(str(tmp_path / "manifest.db")).execute("SELECT title, status FROM entries;"))
+    assert statuses == {"100001.zip": "done", "100002.zip": "done", "100003.zip": "done",
+                        "100004.zip": "done", "100005.zip": "failed", "100006.zip": "done"}
+    manifest.close()
+
+
+def test_download_from_feed(fake, sleeps, tmp_path, monkeypatch):
+    monkeypatch.setattr(http_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    for i in range(1, 4):
+        fake.zips["10000{}.zip".format(i)] = make_zip("CHAN{}".format(i), 2000)
+
+    resources = list(get_atom_resources("{}/feed".format(fake.url)))
+    assert len(resources) == 4
+
+    out_dir = tmp_path / "2019-06-01"
+    out_dir.mkdir()
+    downloaded = download_feed(resources, str(out_dir), n_workers=2)
+
+    assert sorted(os.listdir(str(out_dir))) == ["100001.zip", "100002.zip", "100003.zip"]
+    assert sorted(downloaded) == sorted("{0}/{1}".format(out_dir, name) for name in fake.zips)
+    for name, data in fake.zips.items():
+        with zipfile.ZipFile(str(out_dir / name)) as archive:
+            assert archive.testzip() is None
+        assert read(str(out_dir / name)) == data
+    assert not any(path.endswith(".pdf") for path, requested in fake.requests)
+
+
+def test_copy_we_already_had_is_checked_by_sync(tmp_path):
+    manifest = open_manifest(str(tmp_path / "manifest.db"))
+    zip_fp = str(tmp_path / "100001.zip")
+    with open(zip_fp, "wb") as zip_file:
+        zip_file.write(b"an older copy")
+    entry = {"link": "http://example.com/zips/100001.zip", "title": "100001.zip", "updated": "2019-06-03T10:00:00Z"}
+
+    # Without --sync the copy is kept, but nothing is said about it in the manifest.
+    assert not needs_download(manifest, entry, zip_fp)
+    assert get_entry(manifest, entry['link']) is None
+    assert os.path.isfile(zip_fp)
+
+    # So --sync can't trust it, and gets rid of it to download it again.
+    assert needs_download(manifest, entry, zip_fp, sync=True)
+    assert not os.path.exists(zip_fp)
+
+    # Once it's been downloaded, it's up to date until the entry changes.
+    with open(zip_fp, "wb") as zip_file:
+        zip_file.write(b"the copy in the feed")
+    record_entry(manifest, entry, zip_fp)
+    record_download(manifest, entry['link'], zip_fp, {})
+    assert not is_new_or_changed(manifest, entry)
+    assert not needs_download(manifest, entry, zip_fp, sync=True)
+    assert needs_download(manifest, dict(entry, updated="2019-07-01T10:00:00Z"), zip_fp, sync=True)
+    assert not os.path.exists(zip_fp)
+    manifest.close()
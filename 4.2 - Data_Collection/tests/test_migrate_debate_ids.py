@@ -0,0 +1,99 @@
+# Checks migrate_debate_ids.py on a database laid out the way make_db.py used to make them, where debates were keyed by
+# the hansard file name, including one with contributions for debates that aren't in the debates table.
+import os
+import sys
+import sqlite3
+import subprocess
+
+from make_db import create_tables
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_FP = os.path.join(os.path.dirname(TESTS_DIR), "migrate_debate_ids.py")
+
+# The two tables as make_db.py used to make them.
+sql_create_old_debates = """
+CREATE TABLE IF NOT EXISTS debates (
+    uid text PRIMARY KEY,
+    date text,
+    hansardNum text,
+    file text
+);"""
+
+sql_create_old_contributions = """
+CREATE TABLE IF NOT EXISTS contributions (
+    uid integer PRIMARY KEY,
+    member integer NOT NULL,
+    debate integer NOT NULL,
+    body text NOT NULL,
+    isQuestion integer NOT NULL,
+    referringTo integer,
+    topic text,
+    section text,
+    contType text,
+    sectionTag text,
+    department text,
+    FOREIGN KEY (member) REFERENCES members (PimsId)
+    FOREIGN KEY (debate) REFERENCES debates (uid)
+);"""
+
+
+# Makes an old database with two debates (given out of date order) and a contribution for each, and a contribution
+# for each of the orphan debates.
+def make_old_db(db_fp, orphans=()):
+    connection = sqlite3.connect(db_fp)
+    connection.execute(sql_create_old_debates)
+    connection.execute(sql_create_old_contributions)
+    create_tables(connection)
+    connection.executemany("INSERT INTO debates(uid, date, hansardNum, file) VALUES(?, ?, ?, ?);",
+                           [("100002-CHAN1", "2019-06-04", "1", "100002-CHAN1"),
+                            ("100001-CHAN1", "2019-06-03", "2", "100001-CHAN1")])
+    contributions = [(1, "100001-CHAN1"), (2, "100002-CHAN1")] + [(3 + i, debate) for i, debate in enumerate(orphans)]
+    connection.executemany("INSERT INTO contributions(uid, member, debate, body, isQuestion) VALUES(?, 1, ?, 'Order.', 0);",
+                           contributions)
+    connection.commit()
+    connection.close()
+
+
+def run_migrate(db_fp, *flags):
+    return subprocess.run([sys.executable, SCRIPT_FP, db_fp] + list(flags), stdout=subprocess.PIPE, universal_newlines=True)
+
+
+def get_contributions(db_fp):
+    connection = sqlite3.connect(db_fp)
+    rows = connection.execute("SELECT uid, debate FROM contributions ORDER BY uid;").fetchall()
+    connection.close()
+    return rows
+
+
+def test_migrate(tmp_path):
+    db_fp = str(tmp_path / "commons.db")
+    make_old_db(db_fp)
+    assert run_migrate(db_fp).returncode == 0
+
+    # The debates get their ids in date order, and the contributions point at them.
+    connection = sqlite3.connect(db_fp)
+    assert connection.execute("SELECT id, uid FROM debates ORDER BY id;").fetchall() == [(1, "100001-CHAN1"), (2, "100002-CHAN1")]
+    connection.close()
+    assert get_contributions(db_fp) == [(1, 1), (2, 2)]
+
+
+def test_orphans_stop_it(tmp_path):
+    db_fp = str(tmp_path / "commons.db")
+    make_old_db(db_fp, orphans=["100009-CHAN2", "100008-CHAN1", "100009-CHAN2"])
+    before = get_contributions(db_fp)
+
+    result = run_migrate(db_fp)
+    assert result.returncode == 1
+    assert "100008-CHAN1 (1), 100009-CHAN2 (2)" in result.stdout
+    # Nothing's been changed.
+    assert get_contributions(db_fp) == before
+    connection = sqlite3.connect(db_fp)
+    assert "id" not in [row[1] for row in connection.execute("PRAGMA table_info(debates);")]
+    connection.close()
+
+
+def test_drop_orphans(tmp_path):
+    db_fp = str(tmp_path / "commons.db")
+    make_old_db(db_fp, orphans=["100009-CHAN2"])
+    assert run_migrate(db_fp, "--drop-orphans").returncode == 0
+    assert get_contributions(db_fp) == [(1, 1), (2, 2)]
@@ -0,0 +1,147 @@
+# Checks that remove_duplicates.py keeps exactly what it did before it grouped the sittings, by running it and
+# the original script (kept in baseline/) on the same directory of debates and comparing what ends up in Final.
+import os
+import sys
+import random
+import subprocess
+
+import pytest
+
+from debate_io import dump_debate, is_debate_file, get_partition_dir
+from processing_manifest import get_manifest_fp, open_manifest, record_sittings, get_sittings
+from remove_duplicates import get_all_files, get_sitting_info, get_files_to_keep
+
+
+def write_debate(fp, date, out_format="json"):
+    # An empty debate has no date at all.
+    debate = {} if date is None else {"{}-1".format(os.path.basename(fp)): {"date": date, "text": "Order."}}
+    with open(fp, "wb") as debate_file:
+        debate_file.write(dump_debate(debate, out_format))
+
+
+# Makes a processed_commons style directory: zips with ids spread over a few days, each with a few sittings,
+# so most sittings turn up in more than one zip. Some are in subdirectories and some have stray whitespace in their date.
+# Unless it's for the original script (which only read .json, and fell over on anything else), some are ndjson,
+# some are empty and there's a file that isn't a debate.
+def make_debates(dir_fp, seed, baseline=False):
+    rand = random.Random(seed)
+    dates = ["3 June 2019", "4 June 2019 ", "5 June 2019", "10 June 2019", "11 July 2019"]
+    for zip_id in rand.sample(range(100000, 100400), 60):
+        subdir = os.path.join(dir_fp, rand.choice(["", "a", "b"]))
+        os.makedirs(subdir, exist_ok=True)
+        date = rand.choice(dates)
+        for chan in rand.sample(range(1, 6), rand.randint(1, 4)):
+            out_format = "json" if baseline else rand.choice(["json", "ndjson"])
+            fp = os.path.join(subdir, "{0}-CHAN{1}.xml.{2}".format(zip_id, chan, out_format))
+            write_debate(fp, None if not baseline and rand.random() < 0.05 else date, out_format)
+    if not baseline:
+        # Not a debate, so never looked at.
+        with open(os.path.join(dir_fp, "notes.txt"), "w") as other_file:
+            other_file.write("[]")
+
+
+def get_debates(dir_fp):
+    return [f for f in get_all_files(dir_fp) if is_debate_file(f)]
+
+
+# Writes the manifest process_xml.py would have written for the debates in the directory.
+def write_manifest(dir_fp):
+    sittings, from_manifest = get_sitting_info(dir_fp, get_debates(dir_fp))
+    manifest = open_manifest(get_manifest_fp(dir_fp))
+    record_sittings(manifest, [dict(sitting, path="zips/{}.zip".format(sitting['source_id']),
+                                    hansard_file=sitting['file'].split(".")[0],
+                                    contributions=0 if sitting['date'] is None else 1) for sitting in sittings.values()])
+    manifest.commit()
+    manifest.close()
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_remove_duplicates(deb_dir, out_dir, script_fp=os.path.join(os.path.dirname(TESTS_DIR), "remove_duplicates.py")):
+    subprocess.run([sys.executable, script_fp, deb_dir, out_dir], check=True, stdout=subprocess.DEVNULL)
+
+
+# Gets the bytes of every debate in a directory, by where it is in the directory.
+def read_debates(dir_fp):
+    debates = dict()
+    for f in get_debates(dir_fp):
+        with open(f, "rb") as debate_file:
+            debates[os.path.relpath(f, dir_fp)] = debate_file.read()
+    return debates
+
+
+def read_manifest_files(dir_fp):
+    manifest = open_manifest(get_manifest_fp(dir_fp))
+    files = sorted(sitting['file'] for sitting in get_sittings(manifest))
+    manifest.close()
+    return files
+
+
+def get_final_files(dir_fp):
+    return sorted(os.path.relpath(f, dir_fp) for f in get_debates(dir_fp))
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("with_manifest", [False, True])
+def test_same_as_baseline(tmp_path, seed, with_manifest):
+    deb_dir = str(tmp_path / "processed")
+    make_debates(deb_dir, seed, baseline=True)
+    run_remove_duplicates(deb_dir, str(tmp_path / "baseline"), os.path.join(TESTS_DIR, "baseline", "remove_duplicates.py"))
+    if with_manifest:
+        write_manifest(deb_dir)
+    run_remove_duplicates(deb_dir, str(tmp_path / "final"))
+
+    # The original script put everything straight in the output directory as DATE-CHANn.json,
+    # where now each goes in the year=/month= directory for its date.
+    baseline = read_debates(str(tmp_path / "baseline"))
+    expected = {os.path.join(get_partition_dir("", name[:10]), name): data for name, data in baseline.items()}
+    final = read_debates(str(tmp_path / "final"))
+    assert final == expected
+    # There really were duplicates to get rid of.
+    assert len(final) < len(get_debates(deb_dir))
+
+
+def test_newest_kept(tmp_path):
+    write_debate(str(tmp_path / "100001-CHAN1.xml.json"), "3 June 2019")
+    write_debate(str(tmp_path / "100007-CHAN1.xml.json"), "3 June 2019")
+    write_debate(str(tmp_path / "100003-CHAN1.xml.json"), "3 June 2019")
+    write_debate(str(tmp_path / "100002-CHAN2.xml.json"), "3 June 2019")
+    write_debate(str(tmp_path / "100004-CHAN1.xml.json"), "4 June 2019")
+    debs = sorted(get_debates(str(tmp_path)))
+    sittings, from_manifest = get_sitting_info(str(tmp_path), debs)
+
+    kept = [os.path.basename(f) for f in get_files_to_keep(debs, sittings)]
+    assert kept == ["100002-CHAN2.xml.json", "100004-CHAN1.xml.json", "100007-CHAN1.xml.json"]
+
+
+def test_manifest_only_has_kept_sittings(tmp_path):
+    deb_dir, out_dir = str(tmp_path / "processed"), str(tmp_path / "final")
+    make_debates(deb_dir, 3)
+    write_manifest(deb_dir)
+    run_remove_duplicates(deb_dir, out_dir)
+    final_files = [os.path.basename(f) for f in get_final_files(out_dir)]
+    assert read_manifest_files(out_dir) == sorted(final_files)
+
+    # Something an earlier run kept, that isn't kept any more.
+    manifest = open_manifest(get_manifest_fp(out_dir))
+    record_sittings(manifest, [{"file": "2001-01-01-CHAN1.json", "hansard_file": "100000-CHAN1", "chan": 1,
+                                "source_id": 100000, "contributions": 1, "date": "2001-01-01"}])
+    manifest.commit()
+    manifest.close()
+
+    run_remove_duplicates(deb_dir, out_dir)
+    assert read_manifest_files(out_dir) == sorted(final_files)
+
+
+def test_old_manifest_removed_without_one(tmp_path):
+    deb_dir, out_dir = str(tmp_path / "processed"), str(tmp_path / "final")
+    make_debates(deb_dir, 4)
+    write_manifest(deb_dir)
+    run_remove_duplicates(deb_dir, out_dir)
+    assert os.path.isfile(get_manifest_fp(out_dir))
+
+    # The later stages would trust it over the files, so it mustn't outlive the manifest it came from.
+    os.remove(get_manifest_fp(deb_dir))
+    run_remove_duplicates(deb_dir, out_dir)
+    assert not os.path.exists(get_manifest_fp(out_dir))
@@ -1,7 +1,7 @@
 import os
 import sys
 import regex as re
-from shutil import copyfile
+from object_store import link_file
 
 if len(sys.argv) > 1:
     in_dir = sys.argv[1]
@@ -14,6 +14,8 @@ directory_re = re.compile(r'.*[\\\/](\d\d\d\d\-\d\d\-\d\d).*?[\\\/](\d+)[\\\/].*
 )
 # iterate through all files and call the find_all_xmls function.
 for subdir, dirs, files in os.walk(in_dir):
+    # Skip hidden directories (e.g. the content index from filter_files.py).
+    dirs[:] = [d for d in dirs if not d.startswith(".")]
     for filename in files:
         curr_fp = os.path.join(subdir, filename).replace("\\", "/")
         print("Reading in {}".format(curr_fp))
@@ -37,9 +39,9 @@ for subdir, dirs, files in os.walk(in_dir):
         new_filename = "{0}-{1}".format(m.group(2), filename)
         out_fp = os.path.join(out_file_dir, new_filename)
 
-        # Check if the file already exists. If not, save it.
+        # Check if the file already exists. If not, link it (rather than copying it).
         if not os.path.isfile(out_fp):
-            copyfile(curr_fp, out_fp)
+            link_file(curr_fp, out_fp)
             print("Writing to {}".format(out_fp))
         else:
             print("There was a problem. There was already a {}.".format(filename))
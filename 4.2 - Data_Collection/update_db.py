@@ -1,11 +1,14 @@
 # This code is used to update an existing database of Hansard Contributions with a new database.
 # The original DB will be kept, with new contributions and members, etc, being added from the new database.
+# Both databases need debates to have an integer id (as make_db.py makes them now). Run migrate_debate_ids.py
+# on one made before that first.
 import sys
 import sqlite3
 import pandas as pd
 
 from sqlite3 import Error as SQLError
-from make_db import create_connection
+from make_db import create_connection, get_members, get_member_index, add_to_member_index, find_member, get_debate_ids
+from migrate_debate_ids import is_migrated
 
 sql_get_contributions = "SELECT * FROM contributions;"
 sql_get_debates = "SELECT * FROM debates;"
@@ -21,6 +24,48 @@ def update_debates_table(cursor, debates):
         cursor.execute(command, curr_entry)
         print(cursor.lastrowid)
 
+# Adds the members in the new database that the old one hasn't got, along with their parties and constituencies.
+# Someone the old database already has under another PimsId is matched by their MNIS or Clerks id instead,
+# and their contributions are given the PimsId the old database uses for them.
+# Returns a map from PimsId in the new database to PimsId in the old one, for the members matched that way.
+def update_members_table(cursor, conn_update, new_members, member_index):
+    update_index = get_member_index(get_members(conn_update))
+    renamed = dict()
+    for pims_id in new_members:
+        pims_id = str(pims_id)
+        if pims_id in member_index['PimsId']:
+            continue
+        member = update_index['PimsId'].get(pims_id)
+        if member is None:
+            print("Member {} isn't in the new database".format(pims_id))
+            continue
+
+        old_member = find_member(member_index, member['MnisId'], member['ClerksId'])
+        if old_member is not None:
+            renamed[int(pims_id)] = old_member['PimsId']
+            continue
+
+        command = '''
+                    INSERT INTO members(PimsId, MnisId, ClerksId, name, curr_party, curr_constituency, member_since, member_until)
+                    VALUES(?, ?, ?, ?, ?, ?, ?, ?);
+                    '''
+        curr_entry = (member['PimsId'], member['MnisId'], member['ClerksId'], member['name'], member['curr_party'],
+                      member['curr_constituency'], member['member_since'], member['member_until'])
+        cursor.execute(command, curr_entry)
+        print("Added member {}".format(member['name']))
+
+        command = '''INSERT INTO member_party(PimsId, start, end, party) VALUES(?, ?, ?, ?);'''
+        cursor.executemany(command, conn_update.execute("SELECT PimsId, start, end, party FROM member_party WHERE PimsId = ?;",
+                                                        (member['PimsId'],)).fetchall())
+        command = '''INSERT INTO member_constituency(PimsId, start, end, constituency) VALUES(?, ?, ?, ?);'''
+        cursor.executemany(command, conn_update.execute("SELECT PimsId, start, end, constituency FROM member_constituency WHERE PimsId = ?;",
+                                                        (member['PimsId'],)).fetchall())
+
+        # So later members with the same ids are matched to this one.
+        add_to_member_index(member_index, member)
+    return renamed
+
+
 def update_contributions_table(cursor, contributions):
     for uid, row in contributions.iterrows():
         command = '''
@@ -45,6 +90,12 @@ if __name__ == "__main__":
     # Now the new database.
     conn_update = create_connection(new_db_fp)
 
+    # The contributions are matched to their debates by id, so both databases need the debates.id column.
+    for db_fp, connection in [(old_db_fp, conn_old), (new_db_fp, conn_update)]:
+        if not is_migrated(connection):
+            print("{0} has no debates.id column. Run python migrate_debate_ids.py {0} first.".format(db_fp))
+            sys.exit(1)
+
     # Read in Old DB
     # Gets all the contributions and creates a nice dataframe
     old_contributions = pd.read_sql_query(sql_get_contributions, conn_old).set_index("uid")
@@ -67,11 +118,15 @@ if __name__ == "__main__":
     # Check if there's new members (hopefully not)
     new_members = update_contributions.query("member not in @old_contributions.member").member.unique()
 
-    # Update the contributions table
+    # The members in the old database, by each of their ids.
+    member_index = get_member_index(get_members(conn_old))
+
+    # Update the members table
     print("------------------------------------")
-    print("Updating contributions")
+    print("Updating members")
     print("------------------------------------")
-    update_contributions_table(curs, new_contributions)
+    renamed = update_members_table(curs, conn_update, new_members, member_index)
+    new_contributions = new_contributions.assign(member=new_contributions.member.map(lambda m: renamed.get(m, m)))
 
     # Update the debates table
     print("------------------------------------")
@@ -79,6 +134,18 @@ if __name__ == "__main__":
     print("------------------------------------")
     update_debates_table(curs, new_debates)
 
+    # The contributions refer to their debate by its id, which isn't the same in the two databases,
+    # so go from the id in the new one to the uid (the hansard file name) to the id in the old one.
+    update_debate_uids = dict(zip(update_debates.id, update_debates.index))
+    old_debate_ids = get_debate_ids(conn_old)
+    new_contributions = new_contributions.assign(debate=new_contributions.debate.map(lambda d: old_debate_ids[update_debate_uids[d]]))
+
+    # Update the contributions table
+    print("------------------------------------")
+    print("Updating contributions")
+    print("------------------------------------")
+    update_contributions_table(curs, new_contributions)
+
     # Commit the changes
     conn_old.commit()
     conn_old.close()
@@ -30,7 +30,7 @@ FROM contributions as c
 INNER JOIN members as m
 ON m.PimsId = c.member
 INNER JOIN debates as d
-ON d.uid = c.debate
+ON d.id = c.debate
 INNER JOIN member_party as p
 ON p.PimsId = m.PimsId
 INNER JOIN member_stances as s